@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark de concurrencia de ImageDatabase
+Mide el rendimiento de lectura (/api/buscar, /api/recientes, /status) con y
+sin subidas de imágenes simultáneas, sobre una base de datos temporal
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from database import ImageDatabase
+
+def fake_image(payload, counter):
+    """Foto distinta por subida: save_image no vuelve a escribir bytes idénticos"""
+    return payload + counter.to_bytes(8, 'big')
+
+def reader_loop(db, codes, stop, latencies, rng):
+    """Alternar las consultas que hacen las páginas de búsqueda y de estado"""
+    while not stop.is_set():
+        operation = rng.choice(('get_image', 'recent', 'search', 'stats'))
+        start = time.perf_counter()
+        if operation == 'get_image':
+            db.get_image(rng.choice(codes))
+        elif operation == 'recent':
+            db.get_recent_codes(50)
+        elif operation == 'search':
+            db.search_codes(rng.choice(codes)[-4:])
+        else:
+            db.get_statistics()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+def writer_loop(db, stop, image_kb, writes, rng):
+    """Subir imágenes sin pausa, como varias secretarias escaneando a la vez"""
+    # Bytes tal como los entrega /guardar-imagen, con el tamaño de una foto de la cámara
+    payload = rng.randbytes(image_kb * 1024)
+    counter = 0
+    while not stop.is_set():
+        counter += 1
+        db.save_image(f"UPLOAD{rng.randrange(10**6):06d}", fake_image(payload, counter), "Benchmark")
+        writes.append(1)
+
+def run_phase(db, codes, readers, writers, duration, image_kb):
+    """Correr lectores (y escritores) durante 'duration' segundos"""
+    stop = threading.Event()
+    latencies, writes = [], []
+    threads = [threading.Thread(target=reader_loop, args=(db, codes, stop, latencies, random.Random(i)))
+               for i in range(readers)]
+    threads += [threading.Thread(target=writer_loop, args=(db, stop, image_kb, writes, random.Random(1000 + i)))
+                for i in range(writers)]
+
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    ordered = sorted(latencies)
+    return {
+        'reads_per_s': len(latencies) / duration,
+        'writes_per_s': len(writes) / duration,
+        'p50_ms': statistics.median(ordered) if ordered else 0,
+        'p95_ms': ordered[int(len(ordered) * 0.95)] if ordered else 0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de lecturas concurrentes con subidas en curso')
+    parser.add_argument('--rows', type=int, default=500, help='Registros iniciales')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5.0, help='Segundos por fase')
+    parser.add_argument('--image-kb', type=int, default=150, help='Tamaño de cada imagen subida')
+    args = parser.parse_args()
+
+    print("⏱️  BENCHMARK DE CONCURRENCIA DE LA BASE DE DATOS")
+    print("=" * 50)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ImageDatabase(os.path.join(tmp, 'benchmark.db'))
+        rng = random.Random(0)
+        payload = rng.randbytes(args.image_kb * 1024)
+        codes = [f"{7500000000000 + i}" for i in range(args.rows)]
+        for counter, codigo in enumerate(codes):
+            db.save_image(codigo, fake_image(payload, counter), "Benchmark")
+        print(f"📦 {args.rows} registros de {args.image_kb} KB, {args.readers} lectores, {args.writers} escritores")
+
+        only_reads = run_phase(db, codes, args.readers, 0, args.duration, args.image_kb)
+        mixed = run_phase(db, codes, args.readers, args.writers, args.duration, args.image_kb)
+        db.close()
+
+    for name, result in (('Solo lecturas', only_reads), ('Con subidas', mixed)):
+        print(f"{name:<14} {result['reads_per_s']:8.0f} lecturas/s  p50 {result['p50_ms']:6.2f} ms  "
+              f"p95 {result['p95_ms']:6.2f} ms  {result['writes_per_s']:6.1f} escrituras/s")
+
+    retained = mixed['reads_per_s'] / only_reads['reads_per_s'] if only_reads['reads_per_s'] else 0
+    print(f"✅ Rendimiento de lectura con subidas en curso: {retained:.0%} del de solo lecturas")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
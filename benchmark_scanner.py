@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pipeline de escaneo sobre un corpus sintético de referencia
+Genera (una sola vez, de forma determinista) códigos EAN13 y CODE128
+renderizados con desenfoque, rotación, ruido y compresión JPEG a varias
+resoluciones, y mide tasa de decodificación, latencia p50/p95, intentos
+hasta el acierto por variación y memoria pico por llamada a scan_image.
+Los resultados se guardan en JSON para comparar corridas en el tiempo.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from scanner import BarcodeScanner
+
+CORPUS_DIR = 'benchmark_corpus'
+RESULTS_DIR = 'benchmark_results'
+MANIFEST_NAME = 'manifest.json'
+CORPUS_VERSION = 2
+
+# Códigos del corpus de referencia (EAN13 con dígito verificador válido)
+CORPUS_CODES = [
+    ('EAN13', '4006381333931'),
+    ('EAN13', '7501031311309'),
+    ('CODE128', 'PKG-000123'),
+    ('CODE128', 'Ubicacion A7'),
+]
+
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+
+# Distorsiones aplicadas a cada código: nombre -> parámetros
+DISTORTIONS = {
+    'limpio': {},
+    'desenfoque': {'blur': 1.8},
+    'rotacion_8': {'rotate': 8},
+    'rotacion_25': {'rotate': 25},
+    'ruido': {'noise': 22},
+    'jpeg_35': {'jpeg': 35},
+    'combinado': {'blur': 1.2, 'rotate': 5, 'noise': 14, 'jpeg': 45},
+}
+
+# Tablas EAN13: patrones L, G y R por dígito y paridad según el primer dígito
+EAN_L = ['0001101', '0011001', '0010011', '0111101', '0100011',
+         '0110001', '0101111', '0111011', '0110111', '0001011']
+EAN_G = [''.join('1' if c == '0' else '0' for c in p)[::-1] for p in EAN_L]
+EAN_R = [''.join('1' if c == '0' else '0' for c in p) for p in EAN_L]
+EAN_PARITY = ['LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+              'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL']
+
+# Tabla CODE128: anchos barra/espacio de los valores 0-106 (106 = parada)
+CODE128_WIDTHS = [
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+]
+CODE128_START_B = 104
+CODE128_STOP = 106
+
+def ean13_modules(code):
+    """Módulos (1 = barra) de un EAN13 de 13 dígitos"""
+    digits = [int(c) for c in code]
+    parity = EAN_PARITY[digits[0]]
+    left = ''.join((EAN_L if parity[i] == 'L' else EAN_G)[digits[i + 1]] for i in range(6))
+    right = ''.join(EAN_R[d] for d in digits[7:])
+    return '101' + left + '01010' + right + '101'
+
+def code128_modules(text):
+    """Módulos de un CODE128 subconjunto B (ASCII 32-127)"""
+    values = [CODE128_START_B] + [ord(c) - 32 for c in text]
+    checksum = (values[0] + sum(i * v for i, v in enumerate(values[1:], start=1))) % 103
+
+    modules = []
+    for value in values + [checksum, CODE128_STOP]:
+        for i, width in enumerate(CODE128_WIDTHS[value]):
+            modules.append(('1' if i % 2 == 0 else '0') * int(width))
+    return ''.join(modules)
+
+def render_barcode(symbology, code, module_px, bar_height):
+    """Imagen L del código con zona de silencio de 10 módulos"""
+    modules = ean13_modules(code) if symbology == 'EAN13' else code128_modules(code)
+    quiet = 10 * module_px
+    image = Image.new('L', (len(modules) * module_px + 2 * quiet, bar_height + 2 * quiet), 255)
+    draw = ImageDraw.Draw(image)
+
+    for i, module in enumerate(modules):
+        if module == '1':
+            x = quiet + i * module_px
+            draw.rectangle([x, quiet, x + module_px - 1, quiet + bar_height], fill=0)
+    return image
+
+def build_frame(symbology, code, resolution, distortion, rng):
+    """Componer un cuadro RGB de cámara con el código distorsionado
+
+    Retorna (cuadro, caja de las barras en el cuadro como [x0, y0, x1, y1]).
+    """
+    width, height = resolution
+
+    # El código ocupa cerca del 40% del ancho, como al apuntar con el móvil
+    modules = len(ean13_modules(code) if symbology == 'EAN13' else code128_modules(code))
+    module_px = max(1, int(width * 0.4 / modules))
+    barcode = render_barcode(symbology, code, module_px, max(20, height // 5))
+
+    if 'rotate' in distortion:
+        barcode = barcode.rotate(distortion['rotate'], resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    # Fondo gris con iluminación irregular
+    gradient = np.linspace(150, 210, width, dtype=np.float32)
+    background = np.tile(gradient, (height, 1))
+    frame = Image.fromarray(background.astype(np.uint8), 'L')
+
+    offset_x = int(rng.integers(0, max(1, width - barcode.width)))
+    offset_y = int(rng.integers(0, max(1, height - barcode.height)))
+    frame.paste(barcode, (offset_x, offset_y))
+
+    # Caja de las barras (sin zona de silencio), recortada al cuadro
+    bars = barcode.point(lambda value: 255 if value < 128 else 0).getbbox()
+    box = [max(0, offset_x + bars[0]), max(0, offset_y + bars[1]),
+           min(width, offset_x + bars[2]), min(height, offset_y + bars[3])]
+
+    if 'blur' in distortion:
+        frame = frame.filter(ImageFilter.GaussianBlur(distortion['blur']))
+
+    if 'noise' in distortion:
+        pixels = np.asarray(frame, dtype=np.float32)
+        pixels += rng.normal(0, distortion['noise'], pixels.shape)
+        frame = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'L')
+
+    return frame.convert('RGB'), box
+
+def generate_corpus(corpus_dir, seed):
+    """Escribir las imágenes del corpus y su manifiesto"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    samples = []
+
+    for symbology, code in CORPUS_CODES:
+        for resolution in RESOLUTIONS:
+            for name, distortion in DISTORTIONS.items():
+                frame, box = build_frame(symbology, code, resolution, distortion, rng)
+                stem = f"{symbology.lower()}_{code.replace(' ', '_')}_{resolution[0]}x{resolution[1]}_{name}"
+
+                if 'jpeg' in distortion:
+                    filename = stem + '.jpg'
+                    frame.save(os.path.join(corpus_dir, filename), 'JPEG', quality=distortion['jpeg'])
+                else:
+                    filename = stem + '.png'
+                    frame.save(os.path.join(corpus_dir, filename), 'PNG')
+
+                samples.append({
+                    'file': filename,
+                    'symbology': symbology,
+                    'expected': code,
+                    'resolution': list(resolution),
+                    'distortion': name,
+                    'box': box
+                })
+
+    manifest = {'version': CORPUS_VERSION, 'seed': seed, 'samples': samples}
+    with open(os.path.join(corpus_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+def load_corpus(corpus_dir, seed, regenerate=False):
+    """Cargar el manifiesto, generándolo si falta o cambió la versión"""
+    manifest_path = os.path.join(corpus_dir, MANIFEST_NAME)
+    if not regenerate and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == CORPUS_VERSION and manifest.get('seed') == seed:
+            return manifest
+
+    print(f"🧪 Generando corpus en {corpus_dir}/ (semilla {seed})...")
+    return generate_corpus(corpus_dir, seed)
+
+def percentile(values, fraction):
+    """Percentil por interpolación lineal (values no vacío)"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def latency_summary(samples):
+    """p50/p95/media de una lista de latencias en ms"""
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 0.50), 2),
+        'p95_ms': round(percentile(samples, 0.95), 2),
+        'mean_ms': round(statistics.fmean(samples), 2)
+    }
+
+def region_contains(region, box):
+    """¿La región candidata contiene la caja entera del código?"""
+    return (region[0] <= box[0] and region[1] <= box[1]
+            and region[2] >= box[2] and region[3] >= box[3])
+
+def run_benchmark(scanner, corpus_dir, manifest, repeat, measure_memory, ingest=False):
+    """Escanear cada muestra y agregar las métricas por muestra y por grupo
+
+    Con 'ingest' la latencia incluye decodificar el archivo con
+    scanner.load_image, como hace /scan con cada subida.
+    """
+    sample_results = []
+
+    for sample in manifest['samples']:
+        with open(os.path.join(corpus_dir, sample['file']), 'rb') as f:
+            data = f.read()
+        image = scanner.load_image(data)
+
+        latencies = []
+        barcodes = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if ingest:
+                image = scanner.load_image(data)
+            barcodes = scanner.scan_image(image)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        attempts = scanner.last_scan_timing.get('attempts', 0)
+        decoded = [b['data'] for b in barcodes]
+        regions = scanner.locate_barcode_regions(image)
+        result = {
+            **sample,
+            'decoded': sample['expected'] in decoded,
+            'false_positive': any(data != sample['expected'] for data in decoded),
+            'method': barcodes[0]['processing_method'] if barcodes else None,
+            'attempts': attempts,
+            'latency_ms': round(statistics.median(latencies), 2),
+            'regions': len(regions),
+            'roi_covered': any(region_contains(region, sample['box']) for region in regions)
+        }
+
+        # Pasada aparte: tracemalloc encarece el escaneo y falsearía la latencia
+        if measure_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            scanner.scan_image(image)
+            result['peak_memory_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+
+        sample_results.append(result)
+        status = '✅' if result['decoded'] else '❌'
+        roi = '▣' if result['roi_covered'] else ('□' if regions else '·')
+        print(f"  {status} {roi} {sample['file']:<55} {result['latency_ms']:8.1f} ms  "
+              f"{attempts:2d} intentos  {result['method'] or '-'}")
+
+    return sample_results
+
+def summarize(sample_results, key=None):
+    """Tasa de decodificación, latencias y memoria de un conjunto de muestras"""
+    groups = {}
+    for result in sample_results:
+        group = 'total' if key is None else str(result[key])
+        groups.setdefault(group, []).append(result)
+
+    summary = {}
+    for group, results in sorted(groups.items()):
+        decoded = [r for r in results if r['decoded']]
+        entry = {
+            'samples': len(results),
+            'decode_rate': round(len(decoded) / len(results), 4),
+            'false_positives': sum(r['false_positive'] for r in results),
+            'roi_coverage': round(sum(r['roi_covered'] for r in results) / len(results), 4),
+            'mean_attempts': round(statistics.fmean(r['attempts'] for r in results), 2),
+            'latency': latency_summary([r['latency_ms'] for r in results]),
+            'latency_success': latency_summary([r['latency_ms'] for r in decoded]),
+        }
+        memory = [r['peak_memory_kb'] for r in results if 'peak_memory_kb' in r]
+        if memory:
+            entry['peak_memory_kb'] = {'max': max(memory), 'mean': round(statistics.fmean(memory), 1)}
+        summary[group] = entry
+    return summary
+
+def attempts_by_variant(sample_results):
+    """Intentos hasta el acierto agrupados por la variación ganadora"""
+    by_variant = {}
+    for result in sample_results:
+        if result['decoded'] and result['method']:
+            by_variant.setdefault(result['method'], []).append(result['attempts'])
+
+    return {
+        method: {
+            'wins': len(attempts),
+            'mean_attempts': round(statistics.fmean(attempts), 2),
+            'max_attempts': max(attempts)
+        }
+        for method, attempts in sorted(by_variant.items(), key=lambda item: -len(item[1]))
+    }
+
+def compare_reports(previous, current):
+    """Imprimir diferencias de las métricas globales contra otra corrida"""
+    old, new = previous['summary']['total'], current['summary']['total']
+    print(f"\n📈 COMPARACIÓN CON {previous.get('timestamp', '?')}")
+    print(f"  Tasa de decodificación: {old['decode_rate']:.1%} -> {new['decode_rate']:.1%}")
+    for metric in ('p50_ms', 'p95_ms'):
+        before, after = old['latency'].get(metric), new['latency'].get(metric)
+        if before and after:
+            print(f"  Latencia {metric[:3]}: {before:8.1f} -> {after:8.1f} ms ({(after - before) / before:+.1%})")
+    if 'peak_memory_kb' in old and 'peak_memory_kb' in new:
+        print(f"  Memoria pico máx.: {old['peak_memory_kb']['max']:.0f} -> {new['peak_memory_kb']['max']:.0f} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del pipeline de escaneo sobre un corpus sintético')
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='Directorio del corpus de referencia')
+    parser.add_argument('--seed', type=int, default=1234, help='Semilla del corpus')
+    parser.add_argument('--regenerate', action='store_true', help='Regenerar el corpus aunque exista')
+    parser.add_argument('--repeat', type=int, default=3, help='Escaneos por muestra (se usa la mediana)')
+    parser.add_argument('--no-memory', action='store_true', help='Omitir la medición de memoria pico')
+    parser.add_argument('--parallel', action='store_true', help='Usar decodificación en paralelo')
+    parser.add_argument('--adaptive', action='store_true', help='Mantener el orden adaptativo de variaciones')
+    parser.add_argument('--ingest', action='store_true', help='Incluir la decodificación del archivo en la latencia')
+    parser.add_argument('--no-draft', action='store_true', help='Decodificar los JPEG a resolución completa')
+    parser.add_argument('--no-roi-fallback', action='store_true',
+                        help='No repetir la cascada en el cuadro completo cuando hay regiones candidatas')
+    parser.add_argument('--resize-filter', default='LANCZOS', help='Filtro de redimensionado (LANCZOS, BILINEAR, BOX...)')
+    parser.add_argument('--output', help='Archivo JSON de resultados (por defecto en benchmark_results/)')
+    parser.add_argument('--compare', help='JSON de una corrida anterior para comparar')
+    args = parser.parse_args()
+
+    print("⏱️  BENCHMARK DEL PIPELINE DE ESCANEO")
+    print("=" * 50)
+
+    manifest = load_corpus(args.corpus, args.seed, args.regenerate)
+
+    # Sin caché ni seguimiento, y sin tocar las estadísticas de producción
+    scanner = BarcodeScanner()
+    scanner.update_config({
+        'result_cache': False,
+        'tracking': False,
+        'stats_file': None,
+        'adaptive_ordering': args.adaptive,
+        'parallel_decoding': args.parallel,
+        'draft_decoding': not args.no_draft,
+        'roi_full_frame_fallback': not args.no_roi_fallback,
+        'resize_filter': args.resize_filter
+    })
+
+    print(f"📂 {len(manifest['samples'])} muestras, {args.repeat} repeticiones por muestra")
+    try:
+        sample_results = run_benchmark(scanner, args.corpus, manifest, args.repeat, not args.no_memory, args.ingest)
+    finally:
+        scanner.shutdown_decode_pool()
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'corpus': {'version': manifest['version'], 'seed': manifest['seed'], 'samples': len(sample_results)},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'options': {'repeat': args.repeat, 'parallel': args.parallel, 'adaptive': args.adaptive,
+                    'ingest': args.ingest},
+        'scanner_config': {key: value for key, value in scanner.get_config().items()
+                           if isinstance(value, (bool, int, float, str, type(None)))},
+        'summary': {
+            'total': summarize(sample_results)['total'],
+            'by_distortion': summarize(sample_results, 'distortion'),
+            'by_resolution': summarize(sample_results, 'resolution'),
+            'by_symbology': summarize(sample_results, 'symbology'),
+        },
+        'attempts_by_variant': attempts_by_variant(sample_results),
+        'samples': sample_results
+    }
+
+    total = report['summary']['total']
+    print("\n📊 RESUMEN")
+    print(f"  Decodificados: {total['decode_rate']:.1%} de {total['samples']} "
+          f"({total['false_positives']} falsos positivos)")
+    print(f"  Latencia: p50 {total['latency'].get('p50_ms', 0):.1f} ms, p95 {total['latency'].get('p95_ms', 0):.1f} ms")
+    print(f"  Regiones que contienen el código entero: {total['roi_coverage']:.1%}; "
+          f"{total['mean_attempts']:.1f} intentos de media")
+    if 'peak_memory_kb' in total:
+        print(f"  Memoria pico por escaneo: máx. {total['peak_memory_kb']['max']:.0f} KB")
+    for name, entry in report['summary']['by_distortion'].items():
+        print(f"  {name:<12} {entry['decode_rate']:6.1%}  p95 {entry['latency'].get('p95_ms', 0):8.1f} ms  "
+              f"regiones {entry['roi_coverage']:6.1%}")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados guardados en {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_reports(json.load(f), report)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,17 +7,67 @@ Mantiene la relación código-imagen con sobrescritura automática
 import sqlite3
 import logging
 import threading
+import queue
 import base64
+import hashlib
+import io
+from contextlib import contextmanager
 from datetime import datetime
 import os
 
+from PIL import Image, features
+
 class ImageDatabase:
     """Clase para gestionar la base de datos de códigos e imágenes"""
     
-    def __init__(self, db_path="scanner_database.db"):
-        """Inicializar base de datos"""
+    # Versión del esquema guardada en PRAGMA user_version:
+    #   1 - tabla única con imagen_blob en la misma fila (esquema original)
+    #   2 - metadatos en codigos_imagenes, imágenes en imagenes_blob
+    #   3 - miniatura_blob junto a cada imagen
+    #   4 - registro de cambios (cambios) e índice (timestamp, codigo)
+    #   5 - totales mantenidos por triggers (estadisticas)
+    #   6 - imágenes por contenido (sha256) en imagenes, con conteo de referencias
+    SCHEMA_VERSION = 6
+    
+    # Tope de resultados por página de search_codes
+    MAX_SEARCH_RESULTS = 100
+    
+    # Días que se conservan los tombstones de códigos eliminados
+    TOMBSTONE_RETENTION_DAYS = 7
+    
+    # Pragmas aplicados a cada conexión del pool (WAL se fija una vez en el archivo)
+    DEFAULT_PRAGMAS = {
+        'synchronous': 'NORMAL',     # Seguro con WAL; evita fsync en cada commit
+        'cache_size': -16000,        # ~16 MB de caché de páginas por conexión
+        'mmap_size': 268435456,      # Lecturas por memoria mapeada (256 MB)
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000         # ms de espera si otro proceso escribe
+    }
+    
+    def __init__(self, db_path="scanner_database.db", pool_size=8, pragmas=None,
+                 thumbnail_size=240, thumbnail_format='WEBP', thumbnail_quality=70):
+        """Inicializar base de datos
+        
+        Las conexiones se reutilizan desde un pool de hasta 'pool_size'
+        conexiones inactivas. Las escrituras se serializan con 'lock'; las
+        lecturas nunca lo toman y, gracias a WAL, no esperan a save_image.
+        
+        Las miniaturas ('thumbnail_size' px de lado máximo) se guardan junto a
+        cada imagen; si Pillow no tiene soporte WebP se usa JPEG.
+        """
         self.db_path = db_path
         self.lock = threading.Lock()
+        self.pragmas = {**self.DEFAULT_PRAGMAS, **(pragmas or {})}
+        self._idle_connections = queue.LifoQueue(maxsize=pool_size)
+        
+        self.search_index = False    # Índice FTS5 trigram disponible (ver init_database)
+        self.listeners = []          # Callbacks (evento, datos) tras cada escritura
+        
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+        self.thumbnail_format = thumbnail_format.upper()
+        if self.thumbnail_format == 'WEBP' and not features.check('webp'):
+            self.thumbnail_format = 'JPEG'
         
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
@@ -26,95 +76,449 @@ class ImageDatabase:
         self.init_database()
         self.logger.info(f"Base de datos inicializada: {self.db_path}")
     
+    def _connect(self):
+        """Abrir una conexión nueva con los pragmas configurados"""
+        # Las conexiones pasan de un hilo a otro a través del pool, pero
+        # nunca las usan dos hilos a la vez
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+    
+    @contextmanager
+    def _connection(self):
+        """Tomar una conexión del pool como transacción (commit o rollback al salir)"""
+        try:
+            conn = self._idle_connections.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        
+        try:
+            with conn:
+                yield conn
+        finally:
+            try:
+                self._idle_connections.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
     def init_database(self):
-        """Crear tabla si no existe"""
+        """Crear las tablas o migrar el esquema existente a SCHEMA_VERSION"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 
-                # Crear tabla principal
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS codigos_imagenes (
-                        codigo TEXT PRIMARY KEY,
-                        imagen_blob BLOB NOT NULL,
-                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        tamaño_kb INTEGER,
-                        dispositivo TEXT
-                    )
-                ''')
+                # WAL: los lectores leen una instantánea mientras otro hilo escribe
+                journal_mode = cursor.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+                if journal_mode.lower() != 'wal':
+                    self.logger.warning(f"⚠️ WAL no disponible, modo de diario: {journal_mode}")
                 
-                # Crear índice para búsquedas rápidas
-                cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_timestamp 
-                    ON codigos_imagenes(timestamp)
-                ''')
+                # Creación y migraciones en una sola transacción: o todo o nada
+                cursor.execute('BEGIN IMMEDIATE')
+                version = self._schema_version(cursor)
                 
-                conn.commit()
-                self.logger.info("✅ Tabla de códigos creada/verificada")
+                if version == 0:
+                    self._create_schema(cursor)
+                elif version > self.SCHEMA_VERSION:
+                    raise RuntimeError(f"Esquema v{version} más nuevo que el soportado (v{self.SCHEMA_VERSION})")
+                else:
+                    for target in range(version + 1, self.SCHEMA_VERSION + 1):
+                        self.logger.info(f"🔄 Migrando base de datos a esquema v{target}...")
+                        getattr(self, f'_migrate_to_v{target}')(cursor)
+                
+                cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+                self.search_index = self._ensure_search_index(cursor)
+                self.logger.info(f"✅ Tablas de códigos creadas/verificadas (esquema v{self.SCHEMA_VERSION})")
                 
         except Exception as e:
             self.logger.error(f"Error inicializando base de datos: {e}")
             raise
     
-    def save_image(self, codigo, imagen_base64, dispositivo="Scanner"):
-        """Guardar imagen asociada a código (sobrescribe si existe)"""
+    def _ensure_search_index(self, cursor):
+        """Crear (si falta) el índice FTS5 trigram para búsquedas por subcadena
+        
+        No forma parte de la versión del esquema porque depende de cómo se
+        compiló SQLite (FTS5 y el tokenizador trigram, 3.34+). Si no está
+        disponible, search_codes recurre a LIKE.
+        """
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'codigos_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        
+        try:
+            # Índice de contenido externo: guarda solo los trigramas; el rowid
+            # es el de codigos_imagenes
+            cursor.execute('''
+                CREATE VIRTUAL TABLE codigos_fts USING fts5(
+                    codigo, tokenize = 'trigram',
+                    content = 'codigos_imagenes', content_rowid = 'rowid'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            self.logger.warning(f"⚠️ Índice de búsqueda FTS5 no disponible ({e}), se usará LIKE")
+            return False
+        
+        # Los triggers mantienen el índice en todas las rutas de escritura
+        cursor.execute('''
+            CREATE TRIGGER codigos_fts_insert AFTER INSERT ON codigos_imagenes BEGIN
+                INSERT INTO codigos_fts (rowid, codigo) VALUES (new.rowid, new.codigo);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER codigos_fts_delete AFTER DELETE ON codigos_imagenes BEGIN
+                INSERT INTO codigos_fts (codigos_fts, rowid, codigo) VALUES ('delete', old.rowid, old.codigo);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER codigos_fts_update AFTER UPDATE OF codigo ON codigos_imagenes BEGIN
+                INSERT INTO codigos_fts (codigos_fts, rowid, codigo) VALUES ('delete', old.rowid, old.codigo);
+                INSERT INTO codigos_fts (rowid, codigo) VALUES (new.rowid, new.codigo);
+            END
+        ''')
+        
+        cursor.execute("INSERT INTO codigos_fts (codigos_fts) VALUES ('rebuild')")
+        self.logger.info("✅ Índice de búsqueda FTS5 trigram creado")
+        return True
+    
+    def _schema_version(self, cursor):
+        """Versión actual del esquema (0 = base de datos vacía)"""
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version:
+            return version
+        
+        # Las bases anteriores al versionado no fijaban user_version
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(codigos_imagenes)')]
+        return 1 if columns else 0
+    
+    def _create_schema(self, cursor):
+        """Crear el esquema actual en una base de datos vacía"""
+        # Metadatos compactos: los listados y el ORDER BY timestamp no leen
+        # páginas de imágenes
+        cursor.execute('''
+            CREATE TABLE codigos_imagenes (
+                codigo TEXT PRIMARY KEY,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                tamaño_kb INTEGER,
+                dispositivo TEXT,
+                imagen_hash TEXT
+            )
+        ''')
+        
+        # Imágenes y miniaturas aparte, una fila por contenido distinto
+        self._create_image_store(cursor)
+        
+        # Índice para listar recientes con paginación por (timestamp, codigo)
+        cursor.execute('''
+            CREATE INDEX idx_recientes 
+            ON codigos_imagenes(timestamp, codigo)
+        ''')
+        
+        self._create_sync_tables(cursor)
+        self._create_stats_table(cursor)
+    
+    def _create_sync_tables(self, cursor):
+        """Registro de cambios para sincronización incremental (/api/recientes?since=)
+        
+        Una fila por código con la secuencia de su último cambio; los borrados
+        quedan como tombstones (eliminado = 1). AUTOINCREMENT garantiza que
+        una secuencia nunca se reutiliza.
+        """
+        cursor.execute('''
+            CREATE TABLE cambios (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                codigo TEXT NOT NULL UNIQUE,
+                eliminado INTEGER NOT NULL DEFAULT 0,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE estado_sincronizacion (
+                clave TEXT PRIMARY KEY,
+                valor INTEGER
+            )
+        ''')
+        
+        # Sobrescribir es DELETE + INSERT: el tombstone lo reemplaza el alta
+        cursor.execute('''
+            CREATE TRIGGER cambios_insert AFTER INSERT ON codigos_imagenes BEGIN
+                REPLACE INTO cambios (codigo, eliminado) VALUES (new.codigo, 0);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER cambios_delete AFTER DELETE ON codigos_imagenes BEGIN
+                REPLACE INTO cambios (codigo, eliminado) VALUES (old.codigo, 1);
+            END
+        ''')
+    
+    def _create_image_store(self, cursor):
+        """Imágenes direccionadas por contenido (sha256 de los bytes)
+        
+        Varios códigos con la misma foto comparten una sola fila. 'referencias'
+        cuenta los códigos que la usan; los triggers la ajustan en la misma
+        transacción que cada alta o borrado de codigos_imagenes y eliminan la
+        imagen cuando ya nadie la referencia.
+        """
+        cursor.execute('''
+            CREATE TABLE imagenes (
+                hash TEXT PRIMARY KEY,
+                imagen_blob BLOB NOT NULL,
+                miniatura_blob BLOB,
+                referencias INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER imagenes_referencia AFTER INSERT ON codigos_imagenes BEGIN
+                UPDATE imagenes SET referencias = referencias + 1 WHERE hash = new.imagen_hash;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER imagenes_liberar AFTER DELETE ON codigos_imagenes BEGIN
+                UPDATE imagenes SET referencias = referencias - 1 WHERE hash = old.imagen_hash;
+                DELETE FROM imagenes WHERE hash = old.imagen_hash AND referencias <= 0;
+            END
+        ''')
+    
+    def _create_stats_table(self, cursor):
+        """Totales de códigos y tamaño, actualizados en la misma transacción
+        que cada INSERT/DELETE (incluida la sobrescritura DELETE + INSERT)
+        """
+        cursor.execute('''
+            CREATE TABLE estadisticas (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_codes INTEGER NOT NULL,
+                total_size_kb INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO estadisticas (id, total_codes, total_size_kb)
+            SELECT 1, COUNT(*), COALESCE(SUM(tamaño_kb), 0) FROM codigos_imagenes
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER estadisticas_insert AFTER INSERT ON codigos_imagenes BEGIN
+                UPDATE estadisticas SET total_codes = total_codes + 1,
+                                        total_size_kb = total_size_kb + COALESCE(new.tamaño_kb, 0)
+                WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER estadisticas_delete AFTER DELETE ON codigos_imagenes BEGIN
+                UPDATE estadisticas SET total_codes = total_codes - 1,
+                                        total_size_kb = total_size_kb - COALESCE(old.tamaño_kb, 0)
+                WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER estadisticas_update AFTER UPDATE OF tamaño_kb ON codigos_imagenes BEGIN
+                UPDATE estadisticas SET total_size_kb = total_size_kb
+                                        - COALESCE(old.tamaño_kb, 0) + COALESCE(new.tamaño_kb, 0)
+                WHERE id = 1;
+            END
+        ''')
+    
+    def _migrate_to_v2(self, cursor):
+        """v1 -> v2: sacar imagen_blob de la tabla de metadatos"""
+        cursor.execute('ALTER TABLE codigos_imagenes RENAME TO codigos_imagenes_v1')
+        cursor.execute('DROP INDEX IF EXISTS idx_timestamp')
+        
+        cursor.execute('''
+            CREATE TABLE codigos_imagenes (
+                codigo TEXT PRIMARY KEY,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                tamaño_kb INTEGER,
+                dispositivo TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE imagenes_blob (
+                codigo TEXT PRIMARY KEY,
+                imagen_blob BLOB NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX idx_timestamp ON codigos_imagenes(timestamp)')
+        
+        cursor.execute('''
+            INSERT INTO codigos_imagenes (codigo, timestamp, tamaño_kb, dispositivo)
+            SELECT codigo, timestamp, tamaño_kb, dispositivo FROM codigos_imagenes_v1
+        ''')
+        cursor.execute('''
+            INSERT INTO imagenes_blob (codigo, imagen_blob)
+            SELECT codigo, imagen_blob FROM codigos_imagenes_v1
+        ''')
+        migrated = cursor.rowcount
+        
+        cursor.execute('DROP TABLE codigos_imagenes_v1')
+        self.logger.info(f"✅ {migrated} imágenes movidas a imagenes_blob "
+                         "(ejecute VACUUM para recuperar espacio en disco)")
+    
+    def _migrate_to_v3(self, cursor):
+        """v2 -> v3: columna de miniaturas (se generan al pedirlas por primera vez)"""
+        cursor.execute('ALTER TABLE imagenes_blob ADD COLUMN miniatura_blob BLOB')
+    
+    def _migrate_to_v4(self, cursor):
+        """v3 -> v4: registro de cambios e índice compuesto para paginar recientes"""
+        cursor.execute('DROP INDEX IF EXISTS idx_timestamp')
+        cursor.execute('CREATE INDEX idx_recientes ON codigos_imagenes(timestamp, codigo)')
+        
+        self._create_sync_tables(cursor)
+        cursor.execute('''
+            INSERT INTO cambios (codigo, eliminado)
+            SELECT codigo, 0 FROM codigos_imagenes ORDER BY rowid
+        ''')
+    
+    def _migrate_to_v5(self, cursor):
+        """v4 -> v5: tabla de totales (se calcula una vez con COUNT/SUM)"""
+        self._create_stats_table(cursor)
+    
+    def _migrate_to_v6(self, cursor):
+        """v5 -> v6: una copia por imagen distinta en lugar de una por código"""
+        cursor.execute('ALTER TABLE codigos_imagenes ADD COLUMN imagen_hash TEXT')
+        self._create_image_store(cursor)
+        
+        # Fila a fila: nunca se cargan todas las imágenes en memoria
+        migrated, unique = 0, 0
+        rows = cursor.connection.execute('SELECT codigo, imagen_blob, miniatura_blob FROM imagenes_blob')
+        for codigo, imagen_bytes, miniatura in rows:
+            imagen_hash = hashlib.sha256(imagen_bytes).hexdigest()
+            cursor.execute('''
+                INSERT OR IGNORE INTO imagenes (hash, imagen_blob, miniatura_blob, referencias)
+                VALUES (?, ?, ?, 0)
+            ''', (imagen_hash, imagen_bytes, miniatura))
+            unique += cursor.rowcount
+            cursor.execute('UPDATE imagenes SET referencias = referencias + 1 WHERE hash = ?',
+                           (imagen_hash,))
+            cursor.execute('UPDATE codigos_imagenes SET imagen_hash = ? WHERE codigo = ?',
+                           (imagen_hash, codigo))
+            migrated += 1
+        
+        cursor.execute('DROP TABLE imagenes_blob')
+        self.logger.info(f"✅ {migrated} imágenes deduplicadas en {unique} únicas "
+                         "(ejecute VACUUM para recuperar espacio en disco)")
+    
+    def save_image(self, codigo, imagen, dispositivo="Scanner"):
+        """Guardar imagen asociada a código (sobrescribe si existe)
+        
+        'imagen' puede ser el archivo en bytes (subidas multipart o binarias)
+        o una cadena base64, con o sin prefijo data:image/...;base64,
+        """
+        try:
+            if isinstance(imagen, (bytes, bytearray, memoryview)):
+                imagen_bytes = bytes(imagen)
+            else:
+                # Decodificar base64 a bytes
+                if imagen.startswith('data:image'):
+                    imagen = imagen.split(',')[1]
+                imagen_bytes = base64.b64decode(imagen)
+            
+            tamaño_kb = len(imagen_bytes) // 1024
+            imagen_hash = hashlib.sha256(imagen_bytes).hexdigest()
+            
+            with self._connection() as conn:
+                stored = conn.execute('SELECT 1 FROM imagenes WHERE hash = ?',
+                                      (imagen_hash,)).fetchone()
+            
+            # La miniatura se genera fuera del lock y solo para contenido nuevo
+            miniatura = None if stored else self._create_thumbnail(imagen_bytes)
+        except Exception as e:
+            self.logger.error(f"Error guardando imagen {codigo}: {e}")
+            return False
+        
+        timestamp = datetime.now()
         with self.lock:
             try:
-                # Decodificar base64 a bytes
-                if imagen_base64.startswith('data:image'):
-                    imagen_base64 = imagen_base64.split(',')[1]
-                
-                imagen_bytes = base64.b64decode(imagen_base64)
-                tamaño_kb = len(imagen_bytes) // 1024
-                
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connection() as conn:
                     cursor = conn.cursor()
                     
-                    # Insertar o actualizar (REPLACE sobrescribe automáticamente)
-                    cursor.execute('''
-                        REPLACE INTO codigos_imagenes 
-                        (codigo, imagen_blob, timestamp, tamaño_kb, dispositivo)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (codigo, imagen_bytes, datetime.now(), tamaño_kb, dispositivo))
+                    # Misma foto reenviada para el mismo código: nada que escribir
+                    cursor.execute('SELECT imagen_hash FROM codigos_imagenes WHERE codigo = ?', (codigo,))
+                    current = cursor.fetchone()
+                    if current and current[0] == imagen_hash:
+                        self.logger.info(f"✅ Imagen sin cambios: {codigo} ({tamaño_kb} KB)")
+                        return True
                     
-                    conn.commit()
+                    # Sobrescribir: DELETE explícito + INSERT. REPLACE no dispara el
+                    # trigger de borrado del índice de búsqueda, y así el rowid
+                    # nuevo sigue el orden de guardado (lo usa search_codes).
+                    # El DELETE libera la referencia a la imagen anterior antes
+                    # de tomar la nueva
+                    cursor.execute('DELETE FROM codigos_imagenes WHERE codigo = ?', (codigo,))
                     
-                    self.logger.info(f"✅ Imagen guardada: {codigo} ({tamaño_kb} KB)")
-                    return True
+                    # Solo se escribe el blob si ese contenido no estaba guardado
+                    # (si se borró entretanto, la miniatura se genera al pedirla)
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO imagenes (hash, imagen_blob, miniatura_blob)
+                        VALUES (?, ?, ?)
+                    ''', (imagen_hash, imagen_bytes, miniatura))
+                    cursor.execute('''
+                        INSERT INTO codigos_imagenes 
+                        (codigo, timestamp, tamaño_kb, dispositivo, imagen_hash)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (codigo, timestamp, tamaño_kb, dispositivo, imagen_hash))
                     
             except Exception as e:
                 self.logger.error(f"Error guardando imagen {codigo}: {e}")
                 return False
+        
+        self.logger.info(f"✅ Imagen guardada: {codigo} ({tamaño_kb} KB)")
+        
+        # Mismo formato de timestamp que devuelven las consultas
+        self._notify('imagen_guardada', {
+            'codigo': codigo,
+            'timestamp': str(timestamp),
+            'tamaño_kb': tamaño_kb,
+            'dispositivo': dispositivo,
+            'version': self._image_version(str(timestamp), tamaño_kb)
+        })
+        return True
     
-    def get_image(self, codigo):
-        """Recuperar imagen por código"""
+    def get_image(self, codigo, include_data=True):
+        """Recuperar imagen por código
+        
+        Con include_data=False solo se leen los metadatos (sin tocar la
+        imagen), por ejemplo para responder con una URL o validar un ETag.
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT imagen_blob, timestamp, tamaño_kb, dispositivo
-                    FROM codigos_imagenes 
-                    WHERE codigo = ?
-                ''', (codigo,))
+                if include_data:
+                    cursor.execute('''
+                        SELECT c.timestamp, c.tamaño_kb, c.dispositivo, b.imagen_blob
+                        FROM codigos_imagenes c
+                        JOIN imagenes b ON b.hash = c.imagen_hash
+                        WHERE c.codigo = ?
+                    ''', (codigo,))
+                else:
+                    cursor.execute('''
+                        SELECT timestamp, tamaño_kb, dispositivo
+                        FROM codigos_imagenes
+                        WHERE codigo = ?
+                    ''', (codigo,))
                 
                 result = cursor.fetchone()
                 
                 if result:
-                    imagen_bytes, timestamp, tamaño_kb, dispositivo = result
-                    
-                    # Convertir bytes a base64
-                    imagen_base64 = base64.b64encode(imagen_bytes).decode('utf-8')
-                    imagen_data_url = f"data:image/jpeg;base64,{imagen_base64}"
+                    timestamp, tamaño_kb, dispositivo = result[:3]
                     
-                    return {
+                    resultado = {
                         'codigo': codigo,
-                        'imagen': imagen_data_url,
                         'timestamp': timestamp,
                         'tamaño_kb': tamaño_kb,
                         'dispositivo': dispositivo,
+                        'version': self._image_version(timestamp, tamaño_kb),
                         'encontrada': True
                     }
+                    
+                    if include_data:
+                        # Convertir bytes a base64
+                        imagen_bytes = result[3]
+                        imagen_base64 = base64.b64encode(imagen_bytes).decode('utf-8')
+                        resultado['imagen'] = f"data:{self.image_mime_type(imagen_bytes)};base64,{imagen_base64}"
+                    
+                    return resultado
                 else:
                     return {
                         'codigo': codigo,
@@ -129,40 +533,81 @@ class ImageDatabase:
                 'error': str(e)
             }
     
+    def get_image_bytes(self, codigo):
+        """Bytes originales de la imagen de un código, o None"""
+        try:
+            with self._connection() as conn:
+                result = conn.execute('''
+                    SELECT b.imagen_blob
+                    FROM codigos_imagenes c
+                    JOIN imagenes b ON b.hash = c.imagen_hash
+                    WHERE c.codigo = ?
+                ''', (codigo,)).fetchone()
+            return result[0] if result else None
+            
+        except Exception as e:
+            self.logger.error(f"Error recuperando imagen {codigo}: {e}")
+            return None
+    
+    @staticmethod
+    def _image_version(timestamp, tamaño_kb):
+        """Identificador corto que cambia cada vez que se sobrescribe la imagen"""
+        return hashlib.sha1(f"{timestamp}|{tamaño_kb}".encode('utf-8')).hexdigest()[:16]
     
+    @staticmethod
+    def image_mime_type(data):
+        """Tipo MIME de una imagen guardada según su cabecera
+        
+        /guardar-imagen guarda los bytes tal como llegan (JPEG, PNG...); las
+        miniaturas son WebP o JPEG.
+        """
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return 'image/png'
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return 'image/gif'
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return 'image/webp'
+        return 'image/jpeg'
 
-    def get_recent_codes(self, limit=200, include_images=False):
-        """Obtener códigos recientes con opción de incluir imágenes"""
+    def get_recent_codes(self, limit=200, include_images=False, before=None):
+        """Obtener códigos recientes con opción de incluir miniaturas
+        
+        'before' es el par (timestamp, codigo) del último registro de la página
+        anterior: la siguiente página empieza justo después (paginación por
+        clave, sin OFFSET).
+        """
+        where, params = '', (limit,)
+        if before is not None:
+            where, params = 'WHERE (c.timestamp, c.codigo) < (?, ?)', (before[0], before[1], limit)
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 
                 if include_images:
-                    # Incluir imágenes para vista previa
+                    # Miniaturas guardadas; la imagen completa solo se lee si
+                    # el registro todavía no tiene miniatura
                     cursor.execute('''
-                        SELECT codigo, timestamp, tamaño_kb, dispositivo, imagen_blob
-                        FROM codigos_imagenes 
-                        ORDER BY timestamp DESC 
+                        SELECT c.codigo, c.timestamp, c.tamaño_kb, c.dispositivo, c.imagen_hash,
+                               b.miniatura_blob,
+                               CASE WHEN b.miniatura_blob IS NULL THEN b.imagen_blob END
+                        FROM codigos_imagenes c
+                        LEFT JOIN imagenes b ON b.hash = c.imagen_hash
+                        {where}
+                        ORDER BY c.timestamp DESC, c.codigo DESC
                         LIMIT ?
-                    ''', (limit,))
+                    '''.format(where=where), params)
                     
                     results = cursor.fetchall()
-                    
-                    return [{
-                        'codigo': row[0],
-                        'timestamp': row[1],
-                        'tamaño_kb': row[2],
-                        'dispositivo': row[3],
-                        'imagen_miniatura': self._create_thumbnail(row[4]) if row[4] else None
-                    } for row in results]
                 else:
                     # Versión original sin imágenes
                     cursor.execute('''
-                        SELECT codigo, timestamp, tamaño_kb, dispositivo
-                        FROM codigos_imagenes 
-                        ORDER BY timestamp DESC 
+                        SELECT c.codigo, c.timestamp, c.tamaño_kb, c.dispositivo
+                        FROM codigos_imagenes c
+                        {where}
+                        ORDER BY c.timestamp DESC, c.codigo DESC
                         LIMIT ?
-                    ''', (limit,))
+                    '''.format(where=where), params)
                     
                     results = cursor.fetchall()
                     
@@ -170,48 +615,178 @@ class ImageDatabase:
                         'codigo': row[0],
                         'timestamp': row[1],
                         'tamaño_kb': row[2],
-                        'dispositivo': row[3]
+                        'dispositivo': row[3],
+                        'version': self._image_version(row[1], row[2])
                     } for row in results]
+            
+            recientes = []
+            for codigo, timestamp, tamaño_kb, dispositivo, imagen_hash, miniatura, imagen_bytes in results:
+                if miniatura is None and imagen_bytes:
+                    # Registros anteriores a las miniaturas: se generan una sola vez
+                    miniatura = self._store_thumbnail(imagen_hash, imagen_bytes)
+                
+                recientes.append({
+                    'codigo': codigo,
+                    'timestamp': timestamp,
+                    'tamaño_kb': tamaño_kb,
+                    'dispositivo': dispositivo,
+                    'version': self._image_version(timestamp, tamaño_kb),
+                    'imagen_miniatura': self._thumbnail_data_url(miniatura)
+                })
+            return recientes
                     
         except Exception as e:
             self.logger.error(f"Error obteniendo códigos recientes: {e}")
             return []
 
+    def get_sync_cursor(self):
+        """Último número de secuencia del registro de cambios"""
+        try:
+            with self._connection() as conn:
+                return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios').fetchone()[0]
+        except Exception as e:
+            self.logger.error(f"Error obteniendo cursor de sincronización: {e}")
+            return 0
+
+    def get_changes(self, since, limit=500):
+        """Códigos agregados/sobrescritos y eliminados después del cursor 'since'
+        
+        Cada código aparece una sola vez con su último cambio. Si el cursor es
+        anterior a tombstones ya purgados (o posterior al último cambio, p. ej.
+        base de datos restaurada), se devuelve reset=True y el cliente debe
+        recargar la lista completa.
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                latest = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM cambios').fetchone()[0]
+                pruned = cursor.execute(
+                    "SELECT valor FROM estado_sincronizacion WHERE clave = 'tombstones_purgados_hasta'"
+                ).fetchone()
+                
+                if since < (pruned[0] if pruned else 0) or since > latest:
+                    return {'cambios': [], 'eliminados': [], 'cursor': latest, 'reset': True, 'hay_mas': False}
+                
+                cursor.execute('''
+                    SELECT ch.seq, ch.codigo, ch.eliminado, c.timestamp, c.tamaño_kb, c.dispositivo
+                    FROM cambios ch
+                    LEFT JOIN codigos_imagenes c ON c.codigo = ch.codigo
+                    WHERE ch.seq > ?
+                    ORDER BY ch.seq
+                    LIMIT ?
+                ''', (since, limit + 1))
+                results = cursor.fetchall()
+            
+            hay_mas = len(results) > limit
+            results = results[:limit]
+            
+            cambios, eliminados = [], []
+            for seq, codigo, eliminado, timestamp, tamaño_kb, dispositivo in results:
+                if eliminado:
+                    eliminados.append(codigo)
+                else:
+                    cambios.append({
+                        'codigo': codigo,
+                        'timestamp': timestamp,
+                        'tamaño_kb': tamaño_kb,
+                        'dispositivo': dispositivo,
+                        'version': self._image_version(timestamp, tamaño_kb)
+                    })
+            
+            return {
+                'cambios': cambios,
+                'eliminados': eliminados,
+                'cursor': results[-1][0] if results else since,
+                'reset': False,
+                'hay_mas': hay_mas
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error obteniendo cambios desde {since}: {e}")
+            return {'cambios': [], 'eliminados': [], 'cursor': since, 'reset': True, 'hay_mas': False}
+
+    def get_thumbnail(self, codigo):
+        """Bytes de la miniatura de un código (se genera si aún no existe)"""
+        try:
+            with self._connection() as conn:
+                result = conn.execute('''
+                    SELECT b.hash, b.miniatura_blob,
+                           CASE WHEN b.miniatura_blob IS NULL THEN b.imagen_blob END
+                    FROM codigos_imagenes c
+                    JOIN imagenes b ON b.hash = c.imagen_hash
+                    WHERE c.codigo = ?
+                ''', (codigo,)).fetchone()
+            
+            if not result:
+                return None
+            
+            imagen_hash, miniatura, imagen_bytes = result
+            if miniatura is None and imagen_bytes:
+                miniatura = self._store_thumbnail(imagen_hash, imagen_bytes)
+            return miniatura
+            
+        except Exception as e:
+            self.logger.error(f"Error obteniendo miniatura {codigo}: {e}")
+            return None
+
     def _create_thumbnail(self, imagen_bytes):
-        """Crear miniatura de imagen para vista previa"""
+        """Crear miniatura reducida (WebP o JPEG) de una imagen"""
         try:
             if not imagen_bytes:
                 return None
-                
-            # Convertir bytes a base64 para miniatura
-            imagen_base64 = base64.b64encode(imagen_bytes).decode('utf-8')
-            imagen_data_url = f"data:image/jpeg;base64,{imagen_base64}"
             
-            return imagen_data_url
+            size = (self.thumbnail_size, self.thumbnail_size)
+            with Image.open(io.BytesIO(imagen_bytes)) as image:
+                # En JPEG, decodificar directamente a una escala reducida
+                image.draft('RGB', size)
+                thumbnail = image.convert('RGB')
+            
+            thumbnail.thumbnail(size, Image.LANCZOS)
+            
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, self.thumbnail_format, quality=self.thumbnail_quality)
+            return buffer.getvalue()
             
         except Exception as e:
             self.logger.debug(f"Error creando miniatura: {e}")
             return None
 
+    def _store_thumbnail(self, imagen_hash, imagen_bytes):
+        """Generar y guardar la miniatura que le falta a una imagen"""
+        miniatura = self._create_thumbnail(imagen_bytes)
+        if miniatura is None:
+            return None
+        
+        with self.lock:
+            with self._connection() as conn:
+                conn.execute('''
+                    UPDATE imagenes SET miniatura_blob = ?
+                    WHERE hash = ? AND miniatura_blob IS NULL
+                ''', (miniatura, imagen_hash))
+        return miniatura
+
+    def _thumbnail_data_url(self, miniatura):
+        """Data URL de una miniatura según su formato real"""
+        if not miniatura:
+            return None
+        return f"data:{self.image_mime_type(miniatura)};base64,{base64.b64encode(miniatura).decode('utf-8')}"
+
 
     def get_statistics(self):
         """Obtener estadísticas de la base de datos"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 
-                # Total de códigos
-                cursor.execute('SELECT COUNT(*) FROM codigos_imagenes')
-                total_codes = cursor.fetchone()[0]
-                
-                # Tamaño total
-                cursor.execute('SELECT SUM(tamaño_kb) FROM codigos_imagenes')
-                total_size_kb = cursor.fetchone()[0] or 0
+                # Totales mantenidos por triggers: una sola fila, sin recorrer la tabla
+                cursor.execute('SELECT total_codes, total_size_kb FROM estadisticas WHERE id = 1')
+                total_codes, total_size_kb = cursor.fetchone()
                 
-                # Código más reciente
+                # Código más reciente (búsqueda directa en idx_recientes)
                 cursor.execute('''
                     SELECT codigo, timestamp FROM codigos_imagenes 
-                    ORDER BY timestamp DESC LIMIT 1
+                    ORDER BY timestamp DESC, codigo DESC LIMIT 1
                 ''')
                 last_code_result = cursor.fetchone()
                 last_code = last_code_result[0] if last_code_result else "N/A"
@@ -223,7 +798,7 @@ class ImageDatabase:
                     'total_size_mb': round(total_size_kb / 1024, 2),
                     'last_code': last_code,
                     'last_timestamp': last_timestamp,
-                    'db_file_size_mb': round(os.path.getsize(self.db_path) / (1024*1024), 2) if os.path.exists(self.db_path) else 0
+                    'db_file_size_mb': round(self._db_file_size() / (1024*1024), 2)
                 }
                 
         except Exception as e:
@@ -237,18 +812,45 @@ class ImageDatabase:
                 'db_file_size_mb': 0
             }
     
-    def search_codes(self, search_term):
-        """Buscar códigos que contengan el término"""
+    def _db_file_size(self):
+        """Tamaño en disco del archivo principal más el diario WAL"""
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal')
+                   if os.path.exists(path))
+    
+    def search_codes(self, search_term, limit=50, offset=0):
+        """Buscar códigos que contengan el término, del más reciente al más antiguo
+        
+        Con el índice trigram los términos de 3+ caracteres no recorren la
+        tabla; los más cortos (o sin índice) usan LIKE, que se detiene al
+        llenar la página. 'limit' se acota a MAX_SEARCH_RESULTS.
+        """
+        limit = max(1, min(int(limit), self.MAX_SEARCH_RESULTS))
+        offset = max(0, int(offset))
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT codigo, timestamp, tamaño_kb, dispositivo
-                    FROM codigos_imagenes 
-                    WHERE codigo LIKE ?
-                    ORDER BY timestamp DESC
-                ''', (f'%{search_term}%',))
+                # El rowid crece con cada guardado: ordenar por rowid equivale
+                # a ordenar por timestamp, sin ordenar todas las coincidencias
+                if self.search_index and len(search_term) >= 3:
+                    cursor.execute('''
+                        SELECT c.codigo, c.timestamp, c.tamaño_kb, c.dispositivo
+                        FROM codigos_fts f
+                        JOIN codigos_imagenes c ON c.rowid = f.rowid
+                        WHERE codigos_fts MATCH ?
+                        ORDER BY f.rowid DESC
+                        LIMIT ? OFFSET ?
+                    ''', ('"' + search_term.replace('"', '""') + '"', limit, offset))
+                else:
+                    escaped = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                    cursor.execute('''
+                        SELECT codigo, timestamp, tamaño_kb, dispositivo
+                        FROM codigos_imagenes 
+                        WHERE codigo LIKE ? ESCAPE '\\'
+                        ORDER BY rowid DESC
+                        LIMIT ? OFFSET ?
+                    ''', (f'%{escaped}%', limit, offset))
                 
                 results = cursor.fetchall()
                 
@@ -267,50 +869,93 @@ class ImageDatabase:
         """Eliminar imagen por código"""
         with self.lock:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connection() as conn:
                     cursor = conn.cursor()
                     
+                    # El trigger imagenes_liberar borra la imagen si era su última referencia
                     cursor.execute('DELETE FROM codigos_imagenes WHERE codigo = ?', (codigo,))
                     deleted_rows = cursor.rowcount
-                    conn.commit()
-                    
-                    if deleted_rows > 0:
-                        self.logger.info(f"✅ Imagen eliminada: {codigo}")
-                        return True
-                    else:
-                        self.logger.warning(f"⚠️ No se encontró código para eliminar: {codigo}")
-                        return False
                         
             except Exception as e:
                 self.logger.error(f"Error eliminando imagen {codigo}: {e}")
                 return False
+        
+        if deleted_rows > 0:
+            self.logger.info(f"✅ Imagen eliminada: {codigo}")
+            self._notify('imagen_eliminada', {'codigo': codigo})
+            return True
+        else:
+            self.logger.warning(f"⚠️ No se encontró código para eliminar: {codigo}")
+            return False
     
     def cleanup_old_images(self, days_old=30):
         """Limpiar imágenes antiguas (opcional)"""
         with self.lock:
             try:
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connection() as conn:
                     cursor = conn.cursor()
                     
+                    # Las imágenes sin otras referencias se liberan por trigger
                     cursor.execute('''
                         DELETE FROM codigos_imagenes 
                         WHERE timestamp < datetime('now', '-' || ? || ' days')
                     ''', (days_old,))
                     
                     deleted_rows = cursor.rowcount
-                    conn.commit()
-                    
-                    if deleted_rows > 0:
-                        self.logger.info(f"🧹 Limpieza: {deleted_rows} imágenes antiguas eliminadas")
                     
-                    return deleted_rows
+                    self._prune_tombstones(cursor)
                     
             except Exception as e:
                 self.logger.error(f"Error en limpieza de imágenes: {e}")
                 return 0
+        
+        if deleted_rows > 0:
+            self.logger.info(f"🧹 Limpieza: {deleted_rows} imágenes antiguas eliminadas")
+            self._notify('imagenes_limpiadas', {'eliminados': deleted_rows})
+        
+        return deleted_rows
+    
+    def _prune_tombstones(self, cursor):
+        """Purgar tombstones viejos y recordar hasta qué secuencia se purgó"""
+        cursor.execute('''
+            SELECT MAX(seq) FROM cambios
+            WHERE eliminado = 1 AND timestamp < datetime('now', '-' || ? || ' days')
+        ''', (self.TOMBSTONE_RETENTION_DAYS,))
+        purged_through = cursor.fetchone()[0]
+        if purged_through is None:
+            return
+        
+        # Todo tombstone hasta esa secuencia se va: un cliente con un cursor
+        # anterior ya no puede recibir todos los borrados y debe recargar
+        cursor.execute('DELETE FROM cambios WHERE eliminado = 1 AND seq <= ?', (purged_through,))
+        cursor.execute('''
+            REPLACE INTO estado_sincronizacion (clave, valor)
+            VALUES ('tombstones_purgados_hasta', ?)
+        ''', (purged_through,))
+    
+    def add_listener(self, callback):
+        """Registrar callback(evento, datos) llamado tras cada escritura confirmada
+        
+        Eventos: 'imagen_guardada', 'imagen_eliminada', 'imagenes_limpiadas'.
+        Se llama fuera del lock de escritura, en el hilo que escribió.
+        """
+        self.listeners.append(callback)
+    
+    def _notify(self, event, data):
+        """Avisar a los listeners; un listener que falla no afecta la escritura"""
+        for callback in list(self.listeners):
+            try:
+                callback(event, data)
+            except Exception as e:
+                self.logger.error(f"Error en listener de '{event}': {e}")
     
     def close(self):
-        """Cerrar conexión (normalmente no necesario con context managers)"""
+        """Cerrar las conexiones inactivas del pool"""
+        while True:
+            try:
+                self._idle_connections.get_nowait().close()
+            except queue.Empty:
+                break
         self.logger.info("Base de datos cerrada")
     
     def test_database(self):
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Difusión de eventos en tiempo real (Server-Sent Events)
+Reparte escaneos, imágenes guardadas/eliminadas y estadísticas a todas las
+páginas conectadas sin que tengan que consultar periódicamente
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+
+class EventSubscription:
+    """Cola de eventos de un cliente conectado"""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+
+class EventBroker:
+    """Reparto de eventos a muchos suscriptores (un hilo por conexión SSE)"""
+
+    def __init__(self, max_subscribers=64, max_queue=100, heartbeat_seconds=15.0):
+        """Inicializar el distribuidor
+
+        Un suscriptor lento cuya cola se llena se desconecta en lugar de
+        frenar a los demás; al reconectar, el cliente se resincroniza.
+        """
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self.heartbeat_seconds = heartbeat_seconds
+
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.next_event_id = 1
+        self.events_published = 0
+
+        self.logger = logging.getLogger(__name__)
+
+    def subscribe(self):
+        """Registrar un suscriptor nuevo (None si se alcanzó el máximo)"""
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+
+            subscription = EventSubscription(self.max_queue)
+            self.subscribers.add(subscription)
+
+        self.logger.info(f"📡 Suscriptor de eventos conectado ({len(self.subscribers)} activos)")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Quitar un suscriptor (idempotente)"""
+        with self.lock:
+            self.subscribers.discard(subscription)
+            subscription.closed = True
+
+        self.logger.info(f"📡 Suscriptor de eventos desconectado ({len(self.subscribers)} activos)")
+
+    def publish(self, event_type, data):
+        """Enviar un evento a todos los suscriptores sin bloquear al emisor"""
+        with self.lock:
+            event_id = self.next_event_id
+            self.next_event_id += 1
+            self.events_published += 1
+
+            message = f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+            for subscription in list(self.subscribers):
+                try:
+                    subscription.queue.put_nowait(message)
+                except queue.Full:
+                    # Cliente que no lee: se corta su conexión
+                    self.subscribers.discard(subscription)
+                    subscription.closed = True
+                    self.logger.warning("⚠️ Suscriptor de eventos lento desconectado")
+
+    def stream(self, subscription):
+        """Generador de texto SSE para una respuesta HTTP de larga duración
+
+        Envía un comentario de latido cuando no hay eventos, para mantener
+        viva la conexión y detectar clientes que ya se fueron.
+        """
+        try:
+            # Reintento del EventSource del navegador tras una desconexión
+            yield "retry: 3000\n\n"
+
+            last_write = time.monotonic()
+            while not subscription.closed:
+                try:
+                    yield subscription.queue.get(timeout=1.0)
+                    last_write = time.monotonic()
+                except queue.Empty:
+                    if time.monotonic() - last_write >= self.heartbeat_seconds:
+                        yield ": latido\n\n"
+                        last_write = time.monotonic()
+        finally:
+            self.unsubscribe(subscription)
+
+    def get_stats(self):
+        """Estadísticas del distribuidor"""
+        return {
+            'subscribers': len(self.subscribers),
+            'max_subscribers': self.max_subscribers,
+            'events_published': self.events_published
+        }
@@ -1,4 +1,4 @@
 #!/bin/bash
 echo "🔒 Iniciando Scanner Server HTTPS..."
 source venv/bin/activate
-python3 server_https.py
+python3 server_https.py "$@"
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Planificador de escaneos con cola acotada
+Un número fijo de hilos trabajadores procesa los escaneos; cuando la cola se
+llena las peticiones se rechazan con una estimación de cuándo reintentar, en
+lugar de que todas se frenen a la vez. Los trabajos se reparten por turnos
+entre dispositivos para que un teléfono en escaneo continuo no acapare el
+servidor.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+class ScanJob:
+    """Trabajo de escaneo y su resultado"""
+
+    QUEUED = 'en_cola'
+    RUNNING = 'procesando'
+    DONE = 'completado'
+    FAILED = 'error'
+    CANCELLED = 'cancelado'
+
+    def __init__(self, device, function):
+        self.id = uuid.uuid4().hex
+        self.device = device
+        self.function = function
+        self.status = self.QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        """Estado del trabajo para la API"""
+        data = {
+            'job_id': self.id,
+            'estado': self.status,
+            'dispositivo': self.device
+        }
+        if self.status == self.DONE:
+            data['resultado'] = self.result
+        elif self.status == self.FAILED:
+            # El detalle queda en el log; al cliente se le da un mensaje fijo
+            data['error'] = 'Error al procesar imagen'
+        return data
+
+class ScanScheduler:
+    """Cola de escaneos con trabajadores fijos y reparto justo por dispositivo"""
+
+    def __init__(self, workers=2, max_queue=16, result_ttl_seconds=60.0,
+                 max_results=256, on_complete=None):
+        """Inicializar el planificador y arrancar los trabajadores
+
+        'max_queue' limita los trabajos en espera (no los que ya se están
+        procesando). Los resultados se conservan 'result_ttl_seconds' para
+        que los clientes en modo asíncrono los consulten. 'on_complete(job)'
+        se llama al terminar cada trabajo, desde el hilo trabajador.
+        """
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_results = max_results
+        self.on_complete = on_complete
+
+        # Una cola por dispositivo; el orden del OrderedDict es el turno
+        self.device_queues = OrderedDict()
+        self.queued = 0
+        self.running = 0
+        self.jobs = OrderedDict()     # job_id -> ScanJob (pendientes y recientes)
+        self.condition = threading.Condition()
+
+        self.stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'total_wait_time': 0.0,
+            'total_run_time': 0.0
+        }
+
+        self.logger = logging.getLogger(__name__)
+
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"scan-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, device, function):
+        """Encolar function() para 'device'; devuelve el ScanJob o None si la cola está llena"""
+        with self.condition:
+            if self.queued >= self.max_queue:
+                self.stats['rejected'] += 1
+                return None
+
+            job = ScanJob(device, function)
+            self.device_queues.setdefault(device, deque()).append(job)
+            self.queued += 1
+            self.stats['submitted'] += 1
+
+            self.jobs[job.id] = job
+            self._prune_jobs()
+
+            self.condition.notify()
+            return job
+
+    def get_job(self, job_id):
+        """Trabajo por id (None si no existe o ya caducó)"""
+        with self.condition:
+            self._prune_jobs()
+            return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        """Quitar de la cola un trabajo que aún no empezó; True si se canceló"""
+        with self.condition:
+            if job.status != ScanJob.QUEUED:
+                return False
+            
+            jobs = self.device_queues[job.device]
+            jobs.remove(job)
+            if not jobs:
+                del self.device_queues[job.device]
+            self.queued -= 1
+            self.jobs.pop(job.id, None)
+            self.stats['cancelled'] += 1
+            
+            job.status = ScanJob.CANCELLED
+            job.function = None   # Liberar la imagen capturada en la clausura
+            job.finished_at = time.time()
+        
+        job.done.set()
+        return True
+    
+    def retry_after(self):
+        """Segundos sugeridos antes de reintentar, según la cola y el tiempo medio"""
+        with self.condition:
+            finished = self.stats['completed'] + self.stats['failed']
+            average = self.stats['total_run_time'] / finished if finished else 1.0
+            backlog = self.queued + self.running
+        return max(1, round(average * backlog / self.workers))
+
+    def _next_job(self):
+        """Siguiente trabajo por turnos: el dispositivo atendido pasa al final"""
+        device, jobs = next(iter(self.device_queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self.device_queues.move_to_end(device)
+        else:
+            del self.device_queues[device]
+        self.queued -= 1
+        return job
+
+    def _worker(self):
+        """Bucle de un hilo trabajador"""
+        while True:
+            with self.condition:
+                while not self.device_queues:
+                    self.condition.wait()
+                job = self._next_job()
+                job.status = ScanJob.RUNNING
+                job.started_at = time.time()
+                self.running += 1
+                self.stats['total_wait_time'] += job.started_at - job.created_at
+
+            try:
+                job.result = job.function()
+                job.status = ScanJob.DONE
+            except Exception as e:
+                self.logger.error(f"❌ Error en trabajo de escaneo {job.id}: {e}")
+                job.error = str(e)
+                job.status = ScanJob.FAILED
+
+            job.finished_at = time.time()
+            job.function = None   # Liberar la imagen capturada en la clausura
+
+            with self.condition:
+                self.running -= 1
+                self.stats['completed' if job.status == ScanJob.DONE else 'failed'] += 1
+                self.stats['total_run_time'] += job.finished_at - job.started_at
+
+            job.done.set()
+
+            if self.on_complete:
+                try:
+                    self.on_complete(job)
+                except Exception as e:
+                    self.logger.debug(f"Error notificando trabajo {job.id}: {e}")
+
+    def _prune_jobs(self):
+        """Olvidar resultados caducados o que exceden max_results (con el lock tomado)"""
+        now = time.time()
+        while self.jobs:
+            job = next(iter(self.jobs.values()))
+            if job.finished_at is None:
+                # Nunca se descarta un trabajo pendiente
+                break
+            expired = now - job.finished_at > self.result_ttl_seconds
+            if not expired and len(self.jobs) <= self.max_results:
+                break
+            self.jobs.popitem(last=False)
+
+    def get_stats(self):
+        """Estadísticas del planificador"""
+        with self.condition:
+            finished = self.stats['completed'] + self.stats['failed']
+            started = finished + self.running
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'queued': self.queued,
+                'running': self.running,
+                'devices_waiting': len(self.device_queues),
+                'submitted': self.stats['submitted'],
+                'rejected': self.stats['rejected'],
+                'completed': self.stats['completed'],
+                'failed': self.stats['failed'],
+                'cancelled': self.stats['cancelled'],
+                'average_wait_time': self.stats['total_wait_time'] / started if started else 0,
+                'average_run_time': self.stats['total_run_time'] / finished if finished else 0
+            }
@@ -5,13 +5,322 @@ Optimizado específicamente para lecturas rápidas y exitosas como una pistola r
 """
 
 from pyzbar import pyzbar
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from pyzbar.pyzbar import ZBarSymbol
+from PIL import Image, ImageFilter, ImageOps
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import io
+import itertools
+import json
 import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin gunicorn hay un solo proceso y basta el lock entre hilos
+    fcntl = None
+
+@contextmanager
+def _file_lock(path):
+    """Bloqueo exclusivo entre procesos mientras dura el bloque (flock sobre 'path')"""
+    if fcntl is None:
+        yield
+        return
+    
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _decode_variant_batch(batch, symbols=None):
+    """Decodificar un lote de variaciones en un proceso trabajador
+    
+    Cada elemento es (clave, bytes, ancho, alto) en escala de grises de 8 bits.
+    Retorna ([(clave, (ancho, alto), códigos)], segundos de CPU usados).
+    """
+    start_cpu = time.process_time()
+    results = []
+    
+    for key, pixels, width, height in batch:
+        try:
+            barcodes = pyzbar.decode((pixels, width, height), symbols=symbols)
+        except Exception:
+            barcodes = []
+        results.append((key, (width, height), barcodes))
+    
+    return results, time.process_time() - start_cpu
+
+# Transformaciones afines (a, b, c, d, e, f): x = a*x' + b*y' + c ; y = d*x' + e*y' + f
+# Llevan puntos de una variación (recorte, rotación, redimensión) al cuadro original.
+_IDENTITY_TRANSFORM = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+
+def _compose_transforms(outer, inner):
+    """Transformación equivalente a aplicar 'inner' y luego 'outer'"""
+    a1, b1, c1, d1, e1, f1 = outer
+    a2, b2, c2, d2, e2, f2 = inner
+    return (a1 * a2 + b1 * d2, a1 * b2 + b1 * e2, a1 * c2 + b1 * f2 + c1,
+            d1 * a2 + e1 * d2, d1 * b2 + e1 * e2, d1 * c2 + e1 * f2 + f1)
+
+def _apply_transform(transform, x, y):
+    """Aplicar una transformación afín a un punto"""
+    a, b, c, d, e, f = transform
+    return (a * x + b * y + c, d * x + e * y + f)
+
+def _rotation_transform(angle, source_size, rotated_size):
+    """Inversa de Image.rotate(angle, expand=True): puntos rotados -> imagen fuente
+    
+    Reproduce la matriz que PIL usa internamente para muestrear la imagen fuente.
+    """
+    theta = -math.radians(angle)
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    (width, height), (new_width, new_height) = source_size, rotated_size
+    center_x, center_y = width / 2.0, height / 2.0
+    
+    # Rotación alrededor del centro de la imagen fuente
+    rotation = (cos_t, sin_t, center_x - cos_t * center_x - sin_t * center_y,
+                -sin_t, cos_t, center_y + sin_t * center_x - cos_t * center_y)
+    # Desplazamiento introducido por expand=True
+    offset = (1.0, 0.0, -(new_width - width) / 2.0, 0.0, 1.0, -(new_height - height) / 2.0)
+    return _compose_transforms(rotation, offset)
+
+def _box_filter(array, size):
+    """Promedio en ventana cuadrada de lado 'size' (impar) usando imagen integral"""
+    pad = size // 2
+    height, width = array.shape
+    padded = np.pad(array, pad, mode='edge')
+    integral = np.pad(padded.cumsum(axis=0, dtype=np.float64).cumsum(axis=1), ((1, 0), (1, 0)))
+    total = (integral[size:size + height, size:size + width]
+             - integral[:height, size:size + width]
+             - integral[size:size + height, :width]
+             + integral[:height, :width])
+    return total / (size * size)
+
+def _grow_box(mask, x, y, gap):
+    """Caja (inclusive) de los True de 'mask' alcanzables desde (x, y)
+    
+    Se amplía la caja mientras haya True a menos de 'gap' píxeles de su
+    borde, así que huecos más angostos que 'gap' no cortan la región.
+    """
+    height, width = mask.shape
+    x0, y0, x1, y1 = x, y, x, y
+    while True:
+        wx0, wy0 = max(0, x0 - gap), max(0, y0 - gap)
+        window = mask[wy0:min(height, y1 + gap + 1), wx0:min(width, x1 + gap + 1)]
+        cols = np.flatnonzero(window.any(axis=0))
+        rows = np.flatnonzero(window.any(axis=1))
+        grown = (min(x0, wx0 + int(cols[0])), min(y0, wy0 + int(rows[0])),
+                 max(x1, wx0 + int(cols[-1])), max(y1, wy0 + int(rows[-1])))
+        if grown == (x0, y0, x1, y1):
+            return grown
+        x0, y0, x1, y1 = grown
+
+class _ArrayCore:
+    """Núcleo de preprocesamiento sobre un único búfer en escala de grises
+    
+    Calcula los niveles de contraste y las binarizaciones con operaciones
+    vectorizadas que escriben en búferes preasignados (reutilizados entre
+    variaciones) y entrega tuplas (bytes, ancho, alto) que pyzbar decodifica
+    sin crear imágenes PIL intermedias.
+    """
+    
+    def __init__(self, gray):
+        self.pixels = np.asarray(gray, dtype=np.uint8)
+        self.height, self.width = self.pixels.shape
+        self.mean = float(self.pixels.mean())
+        self.std = float(self.pixels.std())
+        
+        # Búferes de trabajo reutilizados por todas las variaciones
+        self._work = np.empty(self.pixels.shape, dtype=np.float32)
+        self._mask = np.empty(self.pixels.shape, dtype=bool)
+        self._out = np.empty(self.pixels.shape, dtype=np.uint8)
+    
+    def contrast(self, level):
+        """Equivalente vectorizado de ImageEnhance.Contrast(gray).enhance(level)"""
+        mean = np.float32(int(self.mean + 0.5))
+        np.subtract(self.pixels, mean, out=self._work)
+        np.multiply(self._work, np.float32(level), out=self._work)
+        np.add(self._work, mean, out=self._work)
+        np.clip(self._work, 0, 255, out=self._work)
+        self._out[...] = self._work
+        return self._emit()
+    
+    def threshold(self, value):
+        """Binarización: 255 donde el píxel supera 'value', 0 en el resto"""
+        np.greater(self.pixels, np.float32(value), out=self._mask)
+        np.multiply(self._mask, np.uint8(255), out=self._out)
+        return self._emit()
+    
+    def _emit(self):
+        """Copiar el búfer de salida a (bytes, ancho, alto) para pyzbar"""
+        return (self._out.tobytes(), self.width, self.height)
+
+class _VariantContext:
+    """Fuente perezosa de datos compartidos entre variaciones de un escaneo
+    
+    Guarda la imagen base y calcula bajo demanda, una sola vez, la escala de
+    grises y los resultados intermedios que reutilizan varias variaciones.
+    """
+    
+    def __init__(self, scanner, base, gray=None):
+        self.scanner = scanner
+        self.base = base
+        self._memo = {} if gray is None else {'gray': gray}
+    
+    @property
+    def gray(self):
+        """Imagen base en escala de grises (calculada al primer uso)"""
+        return self.memo('gray', lambda: self.scanner._convert_to_optimal_grayscale(self.base))
+    
+    @property
+    def gray_buffer(self):
+        """Escala de grises como (bytes, ancho, alto), copiada una sola vez"""
+        return self.memo('gray_buffer', lambda: self.scanner._to_gray_buffer(self.gray))
+    
+    @property
+    def core(self):
+        """Núcleo vectorizado sobre la escala de grises (creado al primer uso)"""
+        return self.memo('array_core', lambda: _ArrayCore(self.gray))
+    
+    def memo(self, key, factory):
+        """Obtener un resultado intermedio, calculándolo la primera vez"""
+        if key not in self._memo:
+            self._memo[key] = factory()
+        return self._memo[key]
+
+class _FrameDecode:
+    """Estado de la decodificación de un cuadro: variaciones por intentar y resultados"""
+    
+    def __init__(self, scanner, image, track):
+        self.variants = scanner._iter_variants(image, track)
+        self.frame_size = scanner._source_size(image)
+        self.barcodes_found = []
+        self.attempted = []
+        self.successful = set()
+        self.variant_info = {}      # clave enviada al pool -> (método, transformación)
+
+class ScanResultCache:
+    """Caché LRU con expiración de resultados de escaneo
+    
+    Las claves son (hash perceptual del cuadro, simbologías): cuadros casi
+    idénticos enviados en ráfaga (reintentos, doble toque, espera de enfoque)
+    reutilizan el resultado del primero sin repetir la cascada.
+    """
+    
+    def __init__(self, max_entries=64, ttl_seconds=2.0, max_distance=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.entries = OrderedDict()  # (hash, simbologías) -> (instante, resultados)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def get(self, frame_hash, symbols_key):
+        """Resultados guardados para un cuadro equivalente, o None"""
+        now = time.monotonic()
+        
+        with self.lock:
+            self._expire(now)
+            key = self._find(frame_hash, symbols_key)
+            
+            # El orden LRU no es el de inserción: revisar también la entrada hallada
+            if key is not None and now - self.entries[key][0] > self.ttl_seconds:
+                del self.entries[key]
+                key = None
+            
+            if key is None:
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return [dict(result) for result in self.entries[key][1]]
+    
+    def put(self, frame_hash, symbols_key, results):
+        """Guardar los resultados de un cuadro (desalojando el menos reciente)"""
+        with self.lock:
+            key = (frame_hash, symbols_key)
+            self.entries[key] = (time.monotonic(), [dict(result) for result in results])
+            self.entries.move_to_end(key)
+            
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        """Vaciar la caché"""
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self):
+        """Contadores de aciertos y fallos"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self.entries),
+                'ttl_seconds': self.ttl_seconds
+            }
+    
+    def _expire(self, now):
+        """Eliminar las entradas vencidas del extremo menos reciente"""
+        while self.entries:
+            key, (stored_at, _) = next(iter(self.entries.items()))
+            if now - stored_at <= self.ttl_seconds:
+                break
+            self.entries.popitem(last=False)
+    
+    def _find(self, frame_hash, symbols_key):
+        """Clave exacta o, si se permite, la más cercana por distancia de Hamming"""
+        key = (frame_hash, symbols_key)
+        if key in self.entries or self.max_distance <= 0:
+            return key if key in self.entries else None
+        
+        for candidate_hash, candidate_symbols in reversed(self.entries):
+            if (candidate_symbols == symbols_key and
+                    bin(candidate_hash ^ frame_hash).count('1') <= self.max_distance):
+                return (candidate_hash, candidate_symbols)
+        return None
+
 class BarcodeScanner:
     """Clase optimizada para escanear códigos de barras con máxima eficiencia"""
     
+    # Nombre de formato -> simbología de zbar (None: zbar no la soporta)
+    SYMBOLOGY_MAP = {
+        'CODE128': ZBarSymbol.CODE128, 'CODE39': ZBarSymbol.CODE39,
+        'CODE93': ZBarSymbol.CODE93, 'CODABAR': ZBarSymbol.CODABAR,
+        'EAN8': ZBarSymbol.EAN8, 'EAN13': ZBarSymbol.EAN13,
+        'UPC_A': ZBarSymbol.UPCA, 'UPCA': ZBarSymbol.UPCA,
+        'UPC_E': ZBarSymbol.UPCE, 'UPCE': ZBarSymbol.UPCE,
+        'ISBN10': ZBarSymbol.ISBN10, 'ISBN13': ZBarSymbol.ISBN13,
+        'I25': ZBarSymbol.I25, 'DATABAR': ZBarSymbol.DATABAR,
+        'DATABAR_EXP': ZBarSymbol.DATABAR_EXP, 'PDF417': ZBarSymbol.PDF417,
+        'QR': ZBarSymbol.QRCODE, 'QRCODE': ZBarSymbol.QRCODE,
+        'ISSN': None, 'AZTEC': None, 'DATAMATRIX': None
+    }
+    
+    # Variaciones baratas que siempre se prueban sobre el cuadro completo;
+    # el resto de la cascada se aplica a las regiones candidatas
+    FULL_FRAME_VARIANTS = ('original',)
+    
+    # Etiquetas retiradas -> etiqueta que las reemplaza (estadísticas guardadas)
+    RENAMED_VARIANTS = {'grayscale_optimized': 'original'}
+    
+    # Prefijo de las variaciones que reutilizan el último acierto de una sesión
+    TRACKED_PREFIX = 'tracked_'
+    
     def __init__(self):
         """Inicializar el scanner optimizado"""
         self.supported_formats = [
@@ -30,6 +339,8 @@ class BarcodeScanner:
             'resize_image': True,
             'max_width': 1200,
             'max_height': 900,
+            'resize_filter': 'LANCZOS',   # Filtro de _smart_resize (nombre de Image.Resampling)
+            'draft_decoding': True,       # load_image: decodificar JPEG ya reducido (escalado DCT)
             'sharpen_image': True,
             'brightness_adjust': True,
             
@@ -44,11 +355,105 @@ class BarcodeScanner:
             # Configuración de calidad
             'min_code_length': 3,
             'max_processing_attempts': 15,  # Más intentos para mayor éxito
-            'quality_threshold': 0.7
+            'quality_threshold': 0.7,
+            
+            # Simbologías a decodificar (None = todas). Ej: ['EAN13', 'UPC_A', 'CODE128']
+            'enabled_symbologies': None,
+            # Perfiles por dispositivo: {dispositivo: {'enabled_symbologies': [...]}}
+            'device_profiles': {},
+            
+            # Caché de resultados por hash perceptual del cuadro
+            'result_cache': True,
+            'cache_ttl_seconds': 2.0,
+            'cache_max_entries': 64,
+            'cache_hash_size': 16,        # dHash de 16x16 bits
+            'cache_max_distance': 0,      # Bits distintos tolerados entre hashes
+            
+            # Seguimiento entre cuadros para escaneo continuo por sesión
+            'tracking': True,
+            'tracking_margin': 0.5,       # Ampliación de la caja previa (fracción por lado)
+            'tracking_ttl_seconds': 10.0,
+            'tracking_max_sessions': 256,
+            
+            # Ráfagas de cuadros (scan_batch): consenso entre capturas seguidas
+            'batch_max_frames': 5,
+            'batch_stop_on_confident': True,  # Parar en el primer cuadro sobre quality_threshold
+            'batch_duplicate_distance': 8,    # Bits de dHash para tratar dos cuadros como el mismo
+            
+            # Perfil de captura anunciado a los clientes (get_capture_profile):
+            # niveles de menos a más píxeles; crop_margin es el margen alrededor
+            # de la guía de apuntado (fracción de su tamaño), None = cuadro completo
+            'capture_levels': [
+                {'max_width': 800, 'jpeg_quality': 0.8, 'crop_margin': 0.25},
+                {'max_width': 1024, 'jpeg_quality': 0.85, 'crop_margin': 0.6},
+                {'max_width': 1200, 'jpeg_quality': 0.9, 'crop_margin': None},
+            ],
+            'capture_adaptive': True,
+            'capture_min_samples': 8,     # Resultados antes de reconsiderar el nivel
+            'capture_raise_below': 0.6,   # Fracción de lecturas fáciles bajo la cual se sube de nivel
+            'capture_lower_above': 0.9,   # ... y sobre la cual se baja (con el doble de muestras)
+            
+            # Orden adaptativo de variaciones según aciertos por método
+            'adaptive_ordering': True,
+            'stats_decay': 0.98,          # Peso que conserva cada escaneo anterior
+            'stats_smoothing': 2.0,       # Intentos "virtuales" para no sobrevalorar un acierto aislado
+            'stats_file': 'scanner_stats.json',
+            'stats_save_interval': 10,    # Escaneos entre guardados a disco
+            
+            # Decodificación paralela en un pool de procesos (opcional)
+            'parallel_decoding': False,
+            'parallel_workers': None,     # None = un proceso por núcleo
+            'parallel_batch_size': 3,     # Variaciones por lote enviado a cada proceso
+            
+            # Localización de regiones candidatas antes de la cascada costosa
+            'roi_localization': True,
+            'roi_analysis_width': 320,    # Ancho del mapa de energía de gradiente
+            'roi_max_regions': 2,
+            'roi_min_contrast': 2.0,      # Desviaciones sobre la media para aceptar un pico
+            'roi_margin': 0.15,           # Margen (zona de silencio) alrededor de cada región
+            # Cascada completa también sobre el cuadro entero si las regiones
+            # fallan. Desactivarlo ahorra la mitad de intentos en cuadros sin
+            # lectura, pero el corpus sintético no basta para medir cuántas
+            # lecturas se pierden: se mantiene hasta medirlo con capturas reales
+            'roi_full_frame_fallback': True
         }
         
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        
+        # Estadísticas por método: {etiqueta: {'hits': float, 'attempts': float}}
+        self.method_stats = {}
+        self.scans_recorded = 0
+        self._scans_since_save = 0
+        # Lo que ya está en disco (envejecido igual que method_stats): al
+        # guardar solo se suma al archivo lo aprendido desde entonces
+        self._saved_stats = {}
+        self._saved_scans = 0
+        self._stats_lock = threading.Lock()
+        self.load_method_stats()
+        
+        # Pool de procesos para decodificación paralela (se crea al primer uso)
+        self._decode_pool = None
+        self._pool_workers = 0
+        self._pool_lock = threading.Lock()
+        self.last_scan_timing = {}
+        
+        # Último acierto por sesión: {sesión: {'box', 'method', 'frame_size', 'updated'}}
+        self.tracking_sessions = OrderedDict()
+        self._tracking_lock = threading.Lock()
+        
+        # Nivel actual del perfil de captura y resultados medidos con él
+        self.capture_level = 0
+        self.capture_samples = 0
+        self.capture_easy = 0
+        self._capture_lock = threading.Lock()
+        
+        self.result_cache = ScanResultCache(
+            max_entries=self.config['cache_max_entries'],
+            ttl_seconds=self.config['cache_ttl_seconds'],
+            max_distance=self.config['cache_max_distance']
+        )
+        
         self.logger.info("Scanner optimizado para pistola lectora inicializado")
     
     def is_ready(self):
@@ -58,67 +463,325 @@ class BarcodeScanner:
     def preprocess_image_optimized(self, image):
         """Preprocesamiento optimizado específicamente para códigos de barras"""
         try:
-            processed_images = []
-            
-            # Asegurar que tenemos una imagen PIL
-            if not isinstance(image, Image.Image):
-                image = Image.fromarray(image)
-            
-            # Convertir a RGB si es necesario
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # 1. REDIMENSIONAMIENTO INTELIGENTE
-            original_size = image.size
-            if self.config['resize_image']:
-                image = self._smart_resize(image)
-            
-            # 2. IMAGEN ORIGINAL PROCESADA
-            processed_images.append(('original', image))
-            
-            # 3. CONVERSIÓN A ESCALA DE GRISES OPTIMIZADA
-            gray_image = self._convert_to_optimal_grayscale(image)
-            processed_images.append(('grayscale_optimized', gray_image))
-            
-            # 4. MEJORA DE ENFOQUE ESPECÍFICA PARA CÓDIGOS
-            if self.config['focus_enhancement']:
-                focused_images = self._enhance_focus_for_barcodes(gray_image)
-                processed_images.extend(focused_images)
-            
-            # 5. CORRECCIÓN DE CONTRASTE MÚLTIPLE
-            if self.config['enhance_contrast']:
-                contrast_images = self._multi_contrast_enhancement(gray_image)
-                processed_images.extend(contrast_images)
-            
-            # 6. MEJORA DE BORDES PARA CÓDIGOS DE BARRAS
-            if self.config['edge_enhancement']:
-                edge_images = self._enhance_edges_for_barcodes(gray_image)
-                processed_images.extend(edge_images)
-            
-            # 7. CORRECCIÓN DE ROTACIÓN
-            if self.config['rotation_correction']:
-                rotated_images = self._rotation_correction(gray_image)
-                processed_images.extend(rotated_images)
-            
-            # 8. UMBRALIZACIÓN MÚLTIPLE
-            if self.config['multi_threshold']:
-                threshold_images = self._multi_threshold_processing(gray_image)
-                processed_images.extend(threshold_images)
-            
-            # 9. REDUCCIÓN DE RUIDO AVANZADA
-            if self.config['noise_reduction']:
-                denoised_images = self._advanced_noise_reduction(gray_image)
-                processed_images.extend(denoised_images)
+            processed_images = list(self._iter_variants(image))
             
             self.logger.info(f"Generadas {len(processed_images)} variaciones optimizadas")
             
             # Retornar solo las imágenes (sin etiquetas para compatibilidad)
-            return [img for label, img in processed_images]
+            return [self._as_image(img) for label, img, transform in processed_images]
             
         except Exception as e:
             self.logger.error(f"Error en preprocesamiento optimizado: {str(e)}")
+            if isinstance(image, tuple):
+                return [self._as_image(image)]
             return [image] if isinstance(image, Image.Image) else [Image.fromarray(image)]
     
+    def load_image(self, source):
+        """Abrir un JPEG/PNG recibido (bytes o archivo) listo para scan_image
+        
+        Los JPEG se decodifican directamente a la escala 1/2, 1/4 u 1/8 más
+        pequeña que aún cubre el tamaño de trabajo (max_width x max_height),
+        sin pasar por la resolución completa. Se aplica la orientación EXIF y
+        se recuerda el tamaño original en info['source_size'], de modo que
+        las coordenadas de los códigos siguen refiriéndose al cuadro subido.
+        """
+        image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        orientation = image.getexif().get(0x0112, 1)   # Etiqueta EXIF Orientation
+        
+        # Con las orientaciones 5-8 la imagen guardada está girada 90°
+        width, height = image.size
+        max_width, max_height = self.config['max_width'], self.config['max_height']
+        if orientation in (5, 6, 7, 8):
+            max_width, max_height = max_height, max_width
+        
+        if self.config['draft_decoding'] and self.config['resize_image'] and image.format == 'JPEG':
+            ratio = min(max_width / width, max_height / height)
+            if ratio < 1:
+                mode = image.mode if image.mode in ('L', 'RGB') else 'RGB'
+                image.draft(mode, (math.ceil(width * ratio), math.ceil(height * ratio)))
+        
+        image.load()
+        if orientation != 1:
+            image = ImageOps.exif_transpose(image)
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+        
+        image.info['source_size'] = (width, height)
+        return image
+    
+    def _source_size(self, image):
+        """Tamaño (ancho, alto) de una entrada PIL, numpy o (bytes, ancho, alto)
+        
+        Para imágenes abiertas con load_image es el tamaño del archivo
+        original, aunque se haya decodificado a una escala menor.
+        """
+        if isinstance(image, Image.Image):
+            return image.info.get('source_size', image.size)
+        if isinstance(image, tuple):
+            return (image[1], image[2])
+        return (image.shape[1], image.shape[0])
+    
+    def _variant_size(self, variant):
+        """Tamaño (ancho, alto) de una variación PIL o (bytes, ancho, alto)"""
+        if isinstance(variant, tuple):
+            return (variant[1], variant[2])
+        return variant.size
+    
+    def _as_image(self, variant):
+        """Convertir una variación (bytes, ancho, alto) a imagen PIL en escala de grises"""
+        if isinstance(variant, tuple):
+            pixels, width, height = variant
+            return Image.frombytes('L', (width, height), pixels)
+        return variant
+    
+    def _prepare_base_image(self, image):
+        """Normalizar la imagen de entrada (PIL, RGB o L y tamaño de trabajo)"""
+        # Asegurar que tenemos una imagen PIL
+        if isinstance(image, tuple):
+            image = self._as_image(image)
+        elif not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+        
+        # Convertir a RGB si es necesario (la escala de grises se conserva tal cual)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        
+        # 1. REDIMENSIONAMIENTO INTELIGENTE
+        if self.config['resize_image']:
+            image = self._smart_resize(image)
+        
+        return image
+    
+    def _iter_variants(self, image, track=None):
+        """Generador perezoso de variaciones (etiqueta, imagen, transformación)
+        
+        Cada variación se construye solo cuando el consumidor la pide, así que
+        si el escaneo termina temprano no se paga el filtrado de las restantes.
+        El orden sigue las estadísticas de éxito por método cuando
+        'adaptive_ordering' está activo. La transformación lleva coordenadas
+        de la variación al cuadro original recibido.
+        
+        Con 'track' (último acierto de la sesión) se prueba primero el recorte
+        y el método de ese acierto, antes de la cascada completa.
+        """
+        source_size = self._source_size(image)
+        context = _VariantContext(self, self._prepare_base_image(image))
+        
+        # Del cuadro de trabajo (posiblemente reducido) al cuadro original
+        width, height = context.base.size
+        frame_transform = (source_size[0] / width, 0.0, 0.0, 0.0, source_size[1] / height, 0.0)
+        
+        catalog = self._ordered_variant_catalog()
+        full_frame = [entry for entry in catalog if entry[0] in self.FULL_FRAME_VARIANTS]
+        cascade = [entry for entry in catalog if entry[0] not in self.FULL_FRAME_VARIANTS]
+        
+        if track is not None and track['frame_size'] == source_size:
+            yield from self._iter_tracked_variants(context, catalog, frame_transform, track)
+        
+        yield from self._build_variants(context, full_frame, frame_transform)
+        
+        regions = self._locate_barcode_regions(context) if self.config['roi_localization'] else []
+        
+        # La cascada costosa trabaja solo sobre los recortes candidatos
+        for box in regions:
+            crop = context.gray.crop(box)
+            region_transform = _compose_transforms(
+                frame_transform, (1.0, 0.0, box[0], 0.0, 1.0, box[1]))
+            yield from self._build_variants(_VariantContext(self, crop, gray=crop), cascade, region_transform)
+        
+        if not regions or self.config['roi_full_frame_fallback']:
+            yield from self._build_variants(context, cascade, frame_transform)
+    
+    def _iter_tracked_variants(self, context, catalog, frame_transform, track):
+        """Variaciones sobre el recorte donde la sesión encontró el último código"""
+        scale_x, scale_y = frame_transform[0], frame_transform[4]
+        x0, y0, x1, y1 = track['box']
+        
+        # Caja en el cuadro de trabajo, ampliada para tolerar el movimiento de la mano
+        pad_x = (x1 - x0) * self.config['tracking_margin']
+        pad_y = (y1 - y0) * self.config['tracking_margin']
+        box = (max(0, int((x0 - pad_x) / scale_x)),
+               max(0, int((y0 - pad_y) / scale_y)),
+               min(context.base.width, int((x1 + pad_x) / scale_x) + 1),
+               min(context.base.height, int((y1 + pad_y) / scale_y) + 1))
+        
+        if box[2] - box[0] < 8 or box[3] - box[1] < 8:
+            return
+        
+        # Primero el método que acertó, luego el recorte sin procesar
+        labels = [track['method'], 'original']
+        tracked = [entry for label in dict.fromkeys(labels) for entry in catalog if entry[0] == label]
+        
+        crop = context.gray.crop(box)
+        region_transform = _compose_transforms(frame_transform, (1.0, 0.0, box[0], 0.0, 1.0, box[1]))
+        yield from self._build_variants(_VariantContext(self, crop, gray=crop), tracked,
+                                        region_transform, prefix=self.TRACKED_PREFIX)
+    
+    def _build_variants(self, context, catalog, transform, prefix=''):
+        """Construir bajo demanda las variaciones de un catálogo sobre un contexto
+        
+        Toda variación se entrega como (bytes, ancho, alto) en escala de grises:
+        se copia una vez al construirla y pyzbar la decodifica sin convertir.
+        """
+        for label, builder, geometry in catalog:
+            try:
+                variant = self._to_gray_buffer(builder(context))
+                variant_transform = transform
+                if geometry is not None:
+                    variant_transform = _compose_transforms(
+                        transform, geometry(context.base.size, self._variant_size(variant)))
+            except Exception as e:
+                self.logger.debug(f"Error generando variación {label}: {e}")
+                continue
+            
+            yield (prefix + label, variant, variant_transform)
+    
+    def locate_barcode_regions(self, image):
+        """Cajas candidatas (x0, y0, x1, y1) en coordenadas del cuadro recibido
+        
+        Las mismas regiones a las que scan_image limita la cascada costosa;
+        sirve para medir su cobertura (benchmark_scanner).
+        """
+        source_width, source_height = self._source_size(image)
+        context = _VariantContext(self, self._prepare_base_image(image))
+        scale_x = source_width / context.base.width
+        scale_y = source_height / context.base.height
+        return [(int(x0 * scale_x), int(y0 * scale_y), math.ceil(x1 * scale_x), math.ceil(y1 * scale_y))
+                for x0, y0, x1, y1 in self._locate_barcode_regions(context)]
+    
+    def _locate_barcode_regions(self, context):
+        """Proponer cajas candidatas con un mapa vectorizado de energía de gradiente
+        
+        Las barras de un código generan mucho gradiente en una dirección y
+        poco en la perpendicular; se suaviza |gx - gy| con una ventana y se
+        crecen cajas alrededor de los picos. Retorna cajas (x0, y0, x1, y1)
+        en coordenadas del cuadro de trabajo.
+        """
+        try:
+            gray = context.gray
+            factor = max(1, math.ceil(gray.width / self.config['roi_analysis_width']))
+            small = gray.reduce(factor) if factor > 1 else gray
+            pixels = np.asarray(small, dtype=np.float32)
+            
+            if min(pixels.shape) < 8:
+                return []
+            
+            # Gradientes centrales horizontal y vertical
+            grad_x = np.zeros_like(pixels)
+            grad_y = np.zeros_like(pixels)
+            grad_x[:, 1:-1] = np.abs(pixels[:, 2:] - pixels[:, :-2])
+            grad_y[1:-1, :] = np.abs(pixels[2:, :] - pixels[:-2, :])
+            
+            window = max(5, (min(pixels.shape) // 12) | 1)
+            energy = _box_filter(np.abs(grad_x - grad_y), window)
+            threshold = energy.mean() + self.config['roi_min_contrast'] * energy.std()
+            
+            frame_area = gray.width * gray.height
+            margin = self.config['roi_margin']
+            regions = []
+            
+            for _ in range(self.config['roi_max_regions']):
+                peak_y, peak_x = np.unravel_index(np.argmax(energy), energy.shape)
+                peak = energy[peak_y, peak_x]
+                if peak <= threshold:
+                    break
+                
+                # Crecer la caja desde el pico saltando huecos de hasta una
+                # ventana: las barras de guarda y los espacios anchos bajan la
+                # energía y, sin cerrar esos huecos, parten el código en dos
+                mask = energy >= max(peak * 0.5, threshold)
+                x0, y0, x1, y1 = _grow_box(mask, peak_x, peak_y, window)
+                
+                # Suprimir esta región (y el halo del suavizado) para buscar la siguiente
+                energy[max(0, y0 - window):y1 + window + 1, max(0, x0 - window):x1 + window + 1] = 0
+                
+                # Escalar al cuadro de trabajo agregando zona de silencio
+                pad_x = int((x1 - x0 + 1) * margin * factor)
+                pad_y = int((y1 - y0 + 1) * margin * factor)
+                box = (max(0, x0 * factor - pad_x),
+                       max(0, y0 * factor - pad_y),
+                       min(gray.width, (x1 + 1) * factor + pad_x),
+                       min(gray.height, (y1 + 1) * factor + pad_y))
+                
+                box_area = (box[2] - box[0]) * (box[3] - box[1])
+                if box[2] - box[0] < 24 or box[3] - box[1] < 8:
+                    continue
+                if box_area > frame_area * 0.8:
+                    # Cubre casi todo el cuadro: recortar no ahorra nada
+                    break
+                
+                regions.append(box)
+            
+            if regions:
+                self.logger.debug(f"Regiones candidatas: {regions}")
+            return regions
+            
+        except Exception as e:
+            self.logger.debug(f"Error localizando regiones candidatas: {e}")
+            return []
+    
+    def _variant_catalog(self):
+        """Catálogo de variaciones habilitadas en su orden por defecto
+        
+        Retorna una lista de (etiqueta, constructor, geometría); cada
+        constructor recibe un _VariantContext y devuelve la imagen de esa
+        variación. La geometría es None si la variación conserva las
+        coordenadas, o una función (tamaño_fuente, tamaño_variación) que
+        devuelve la transformación de la variación a la fuente.
+        """
+        catalog = [
+            # 2. IMAGEN ORIGINAL EN ESCALA DE GRISES (pyzbar siempre decodifica
+            # en grises, así que la antigua variación 'grayscale_optimized'
+            # repetía exactamente esta llamada)
+            ('original', lambda ctx: ctx.gray_buffer, None),
+        ]
+        
+        # 4. MEJORA DE ENFOQUE ESPECÍFICA PARA CÓDIGOS
+        if self.config['focus_enhancement']:
+            catalog.extend(self._enhance_focus_for_barcodes())
+        
+        # 5. CORRECCIÓN DE CONTRASTE MÚLTIPLE
+        if self.config['enhance_contrast']:
+            catalog.extend(self._multi_contrast_enhancement())
+        
+        # 6. MEJORA DE BORDES PARA CÓDIGOS DE BARRAS
+        if self.config['edge_enhancement']:
+            catalog.extend(self._enhance_edges_for_barcodes())
+        
+        # 7. CORRECCIÓN DE ROTACIÓN
+        if self.config['rotation_correction']:
+            catalog.extend(self._rotation_correction())
+        
+        # 8. UMBRALIZACIÓN MÚLTIPLE
+        if self.config['multi_threshold']:
+            catalog.extend(self._multi_threshold_processing())
+        
+        # 9. REDUCCIÓN DE RUIDO AVANZADA
+        if self.config['noise_reduction']:
+            catalog.extend(self._advanced_noise_reduction())
+        
+        return catalog
+    
+    def _ordered_variant_catalog(self):
+        """Catálogo ordenado por tasa de éxito (ponderada con decaimiento)"""
+        catalog = self._variant_catalog()
+        
+        if not self.config['adaptive_ordering']:
+            return catalog
+        
+        with self._stats_lock:
+            scores = {entry[0]: self._method_score(entry[0]) for entry in catalog}
+        
+        # sorted es estable: a igual puntuación se respeta el orden por defecto
+        return sorted(catalog, key=lambda item: -scores[item[0]])
+    
+    def _method_score(self, label):
+        """Tasa de aciertos suavizada de un método (0 si nunca acertó)"""
+        stats = self.method_stats.get(label)
+        if not stats:
+            return 0.0
+        return stats['hits'] / (stats['attempts'] + self.config['stats_smoothing'])
+    
     def _smart_resize(self, image):
         """Redimensionamiento inteligente que preserva la calidad de códigos"""
         width, height = image.size
@@ -131,239 +794,703 @@ class BarcodeScanner:
         ratio = min(self.config['max_width']/width, self.config['max_height']/height)
         new_size = (int(width * ratio), int(height * ratio))
         
-        # Usar LANCZOS para mejor calidad en códigos
-        return image.resize(new_size, Image.Resampling.LANCZOS)
+        # LANCZOS por defecto para mejor calidad en códigos; BILINEAR cuesta
+        # bastante menos, pero solo conviene si benchmark_scanner muestra que
+        # la tasa de decodificación no baja
+        return image.resize(new_size, Image.Resampling[self.config['resize_filter']])
     
     def _convert_to_optimal_grayscale(self, image):
         """Conversión a escala de grises optimizada para códigos de barras"""
-        # Usar conversión weighted que preserva mejor el contraste en códigos
-        r, g, b = image.split()
-        
-        # Pesos optimizados para códigos de barras (más peso al verde)
-        gray = Image.eval(r, lambda x: x * 0.2126)
-        gray = Image.eval(g, lambda x: x * 0.7152).paste(gray, mask=None)
-        gray = Image.eval(b, lambda x: x * 0.0722).paste(gray, mask=None)
-        
-        return image.convert('L')  # Fallback a conversión estándar
+        # La conversión estándar de PIL (ITU-R 601) ya da más peso al verde;
+        # no se generan canales intermedios que luego se descartan
+        if image.mode == 'L':
+            return image
+        return image.convert('L')
     
-    def _enhance_focus_for_barcodes(self, image):
+    def _enhance_focus_for_barcodes(self):
         """Mejora de enfoque específica para códigos de barras"""
-        enhanced_images = []
-        
-        try:
+        return [
             # 1. Sharpening básico
-            sharp_filter = ImageFilter.SHARPEN
-            sharp_image = image.filter(sharp_filter)
-            enhanced_images.append(('sharpen_basic', sharp_image))
+            ('sharpen_basic', lambda ctx: ctx.gray.filter(ImageFilter.SHARPEN), None),
             
             # 2. Unsharp mask optimizado para códigos
-            unsharp_image = image.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-            enhanced_images.append(('unsharp_optimized', unsharp_image))
+            ('unsharp_optimized', lambda ctx: ctx.gray.filter(
+                ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3)), None),
             
             # 3. Sharpening agresivo para códigos muy desenfocados
-            aggressive_unsharp = image.filter(ImageFilter.UnsharpMask(radius=2, percent=200, threshold=2))
-            enhanced_images.append(('unsharp_aggressive', aggressive_unsharp))
+            ('unsharp_aggressive', lambda ctx: ctx.gray.filter(
+                ImageFilter.UnsharpMask(radius=2, percent=200, threshold=2)), None),
             
             # 4. Mejora de bordes con filtro personalizado
-            edge_enhance = image.filter(ImageFilter.EDGE_ENHANCE)
-            enhanced_images.append(('edge_enhance', edge_enhance))
-            
-        except Exception as e:
-            self.logger.debug(f"Error en mejora de enfoque: {e}")
-        
-        return enhanced_images
+            ('edge_enhance', lambda ctx: ctx.gray.filter(ImageFilter.EDGE_ENHANCE), None),
+        ]
     
-    def _multi_contrast_enhancement(self, image):
+    def _multi_contrast_enhancement(self):
         """Múltiples niveles de mejora de contraste"""
-        contrast_images = []
+        # Diferentes niveles de contraste optimizados para códigos
+        contrast_levels = [1.3, 1.7, 2.2, 2.8]
         
-        try:
-            enhancer = ImageEnhance.Contrast(image)
-            
-            # Diferentes niveles de contraste optimizados para códigos
-            contrast_levels = [1.3, 1.7, 2.2, 2.8]
-            
-            for level in contrast_levels:
-                contrast_image = enhancer.enhance(level)
-                contrast_images.append((f'contrast_{level}', contrast_image))
-                
-        except Exception as e:
-            self.logger.debug(f"Error en mejora de contraste: {e}")
-        
-        return contrast_images
+        return [(f'contrast_{level}', lambda ctx, level=level: ctx.core.contrast(level), None)
+                for level in contrast_levels]
     
-    def _enhance_edges_for_barcodes(self, image):
+    def _enhance_edges_for_barcodes(self):
         """Mejora de bordes específica para códigos de barras"""
-        edge_images = []
-        
-        try:
+        return [
             # 1. Edge enhancement básico
-            edge_basic = image.filter(ImageFilter.EDGE_ENHANCE)
-            edge_images.append(('edge_basic', edge_basic))
+            ('edge_basic', lambda ctx: ctx.gray.filter(ImageFilter.EDGE_ENHANCE), None),
             
             # 2. Edge enhancement más agresivo
-            edge_more = image.filter(ImageFilter.EDGE_ENHANCE_MORE)
-            edge_images.append(('edge_aggressive', edge_more))
+            ('edge_aggressive', lambda ctx: ctx.gray.filter(ImageFilter.EDGE_ENHANCE_MORE), None),
             
-            # 3. Filtro FIND_EDGES para detectar bordes
-            edges_only = image.filter(ImageFilter.FIND_EDGES)
-            # Invertir para que las líneas sean negras sobre blanco
-            edges_inverted = ImageOps.invert(edges_only)
-            edge_images.append(('edges_inverted', edges_inverted))
-            
-        except Exception as e:
-            self.logger.debug(f"Error en mejora de bordes: {e}")
-        
-        return edge_images
+            # 3. Filtro FIND_EDGES invertido para que las líneas sean negras sobre blanco
+            ('edges_inverted', lambda ctx: ImageOps.invert(ctx.gray.filter(ImageFilter.FIND_EDGES)), None),
+        ]
     
-    def _rotation_correction(self, image):
+    def _rotation_correction(self):
         """Corrección de rotación para códigos mal orientados"""
-        rotated_images = []
-        
-        try:
-            # Probar rotaciones comunes para códigos mal orientados
-            angles = [-10, -5, 5, 10, -2, 2]  # Rotaciones pequeñas más comunes
-            
-            for angle in angles:
-                # Rotar con fondo blanco (mejor para códigos de barras)
-                rotated = image.rotate(angle, fillcolor=255, expand=True)
-                rotated_images.append((f'rotated_{angle}', rotated))
-                
-        except Exception as e:
-            self.logger.debug(f"Error en corrección de rotación: {e}")
+        # Probar rotaciones comunes para códigos mal orientados
+        angles = [-10, -5, 5, 10, -2, 2]  # Rotaciones pequeñas más comunes
         
-        return rotated_images
+        # Rotar con fondo blanco (mejor para códigos de barras); la geometría
+        # deshace la rotación para reportar coordenadas en el cuadro original
+        return [(f'rotated_{angle}',
+                 lambda ctx, angle=angle: ctx.gray.rotate(angle, fillcolor=255, expand=True),
+                 lambda source_size, rotated_size, angle=angle: _rotation_transform(angle, source_size, rotated_size))
+                for angle in angles]
     
-    def _multi_threshold_processing(self, image):
+    def _multi_threshold_processing(self):
         """Múltiples técnicas de umbralización"""
-        threshold_images = []
+        # Umbrales basados en estadísticas (Otsu-like): media + k * desviación
+        threshold_factors = [-0.5, 0.0, 0.5, 1.0]
         
+        return [(f'threshold_{i}', lambda ctx, factor=factor: self._threshold_variant(ctx, factor), None)
+                for i, factor in enumerate(threshold_factors)]
+    
+    def _threshold_variant(self, ctx, factor):
+        """Binarizar la escala de grises con umbral media + factor * desviación"""
         try:
-            # Convertir a numpy para operaciones avanzadas
-            img_array = np.array(image)
-            
-            # 1. Umbralización automática (Otsu-like)
-            mean_val = np.mean(img_array)
-            std_val = np.std(img_array)
-            
-            # Diferentes umbrales basados en estadísticas
-            thresholds = [
-                mean_val - std_val * 0.5,
-                mean_val,
-                mean_val + std_val * 0.5,
-                mean_val + std_val
-            ]
-            
-            for i, threshold in enumerate(thresholds):
-                binary = np.where(img_array > threshold, 255, 0).astype(np.uint8)
-                binary_image = Image.fromarray(binary)
-                threshold_images.append((f'threshold_{i}', binary_image))
-                
+            core = ctx.core
+            return core.threshold(core.mean + core.std * factor)
+            
         except Exception as e:
             self.logger.debug(f"Error en umbralización múltiple: {e}")
             
-            # Fallback a umbralización simple
-            try:
-                # Umbralización simple con PIL
-                threshold_simple = image.point(lambda x: 0 if x < 128 else 255, '1')
-                threshold_images.append(('threshold_simple', threshold_simple.convert('L')))
-            except:
-                pass
-        
-        return threshold_images
+            # Fallback a umbralización simple con PIL
+            return ctx.gray.point(lambda x: 0 if x < 128 else 255, '1').convert('L')
     
-    def _advanced_noise_reduction(self, image):
+    def _advanced_noise_reduction(self):
         """Reducción avanzada de ruido"""
-        denoised_images = []
+        def median(ctx):
+            return ctx.memo('median_3', lambda: ctx.gray.filter(ImageFilter.MedianFilter(size=3)))
         
-        try:
+        return [
             # 1. Filtro de mediana - excelente para ruido en códigos
-            median_image = image.filter(ImageFilter.MedianFilter(size=3))
-            denoised_images.append(('median_3', median_image))
+            ('median_3', median, None),
             
             # 2. Filtro gaussiano suave
-            gaussian_image = image.filter(ImageFilter.GaussianBlur(radius=0.8))
-            denoised_images.append(('gaussian_soft', gaussian_image))
+            ('gaussian_soft', lambda ctx: ctx.gray.filter(ImageFilter.GaussianBlur(radius=0.8)), None),
             
             # 3. Combinación: mediana + sharpening
-            median_sharp = median_image.filter(ImageFilter.SHARPEN)
-            denoised_images.append(('median_sharp', median_sharp))
+            ('median_sharp', lambda ctx: median(ctx).filter(ImageFilter.SHARPEN), None),
+        ]
+    
+    def scan_image(self, image, device=None, session_id=None):
+        """Escanear códigos de barras con procesamiento optimizado
+        
+        Acepta una imagen PIL, un arreglo numpy o una tupla (bytes, ancho, alto)
+        en escala de grises de 8 bits. 'device' selecciona el perfil de
+        'device_profiles' que corresponda (simbologías habilitadas).
+        'session_id' activa el seguimiento entre cuadros de un mismo cliente.
+        """
+        try:
+            symbols = self._symbols_for_device(device)
+            
+            # Cuadro casi idéntico a uno reciente: devolver el resultado previo
+            frame_hash = None
+            symbols_key = self._symbols_key(symbols)
+            if self.config['result_cache']:
+                frame_hash = self._frame_hash(image)
+                cached = self.result_cache.get(frame_hash, symbols_key)
+                if cached is not None:
+                    self.logger.info(f"Resultado tomado de caché ({len(cached)} códigos)")
+                    return cached
+            
+            barcodes_found, attempts = self._decode_frame(image, symbols, self._get_track(session_id))
+            
+            if frame_hash is not None:
+                self.result_cache.put(frame_hash, symbols_key, barcodes_found)
+            
+            self._update_track(session_id, self._source_size(image), barcodes_found)
+            
+            self.logger.info(f"Escaneo completado en {attempts} intentos. Códigos de calidad encontrados: {len(barcodes_found)}")
+            return barcodes_found
             
         except Exception as e:
-            self.logger.debug(f"Error en reducción de ruido: {e}")
+            self.logger.error(f"Error general en scan_image optimizado: {str(e)}")
+            return []
+    
+    def _symbols_key(self, symbols):
+        """Clave de caché de un conjunto de simbologías (None = todas)"""
+        return tuple(sorted(int(symbol) for symbol in symbols)) if symbols else None
+    
+    def _decode_frame(self, image, symbols, track):
+        """Decodificar un cuadro sin consultar la caché ni el seguimiento
         
-        return denoised_images
+        Registra intentos y tiempos en las estadísticas. Retorna (códigos
+        ordenados por calidad, intentos realizados).
+        """
+        return self._decode_frames([image], symbols, track)[0]
     
-    def scan_image(self, image):
-        """Escanear códigos de barras con procesamiento optimizado"""
-        try:
-            barcodes_found = []
+    def _decode_frames(self, images, symbols, track, stop_on_confident=False):
+        """Decodificar varios cuadros sin consultar la caché ni el seguimiento
+        
+        Con 'parallel_decoding' los lotes de variaciones de todos los cuadros
+        se reparten por turnos en el pool de procesos; si no, los cuadros se
+        decodifican uno tras otro. Con 'stop_on_confident' no se sigue en
+        cuanto un cuadro da un código sobre 'quality_threshold'.
+        
+        Retorna, por cuadro, (códigos ordenados por calidad, intentos
+        realizados); un cuadro que no se llegó a decodificar tiene 0 intentos.
+        """
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        
+        frames = [_FrameDecode(self, image, track) for image in images]
+        
+        worker_cpu = 0.0
+        if self.config['parallel_decoding']:
+            try:
+                worker_cpu = self._scan_frames_parallel(frames, symbols, stop_on_confident)
+            except BrokenProcessPool as e:
+                # Un proceso murió: descartar el pool y repetir en serie
+                self.logger.warning(f"Pool de decodificación inutilizable, escaneando en serie: {str(e)}")
+                self.shutdown_decode_pool()
+                frames = [_FrameDecode(self, image, track) for image in images]
+                self._scan_frames_serial(frames, symbols, stop_on_confident)
+        else:
+            self._scan_frames_serial(frames, symbols, stop_on_confident)
+        
+        for frame in frames:
+            # Ordenar por calidad y retornar los mejores
+            frame.barcodes_found.sort(key=lambda x: x['quality_score'], reverse=True)
+            if frame.attempted:
+                self._record_scan_outcome(frame.attempted, frame.successful)
+        
+        self._record_scan_timing(start_wall, start_cpu, worker_cpu,
+                                 sum(len(frame.attempted) for frame in frames))
+        return [(frame.barcodes_found, len(frame.attempted)) for frame in frames]
+    
+    def scan_batch(self, images, device=None, session_id=None):
+        """Escanear una ráfaga de cuadros del mismo objetivo
+        
+        Todo ocurre dentro del turno del trabajador de la cola de escaneos, sin
+        dejar trabajo en segundo plano. Los cuadros casi idénticos (dHash a
+        'batch_duplicate_distance' bits o menos) se decodifican una sola vez y
+        los demás se decodifican a la vez en el pool de procesos si
+        'parallel_decoding' está activo. Con 'batch_stop_on_confident', en
+        cuanto un cuadro da un código sobre 'quality_threshold' no se sigue
+        con el resto. Cada código aparece una vez, con su mejor lectura y
+        'votes' (cuadros en que se leyó), ordenados por votos y calidad. Solo
+        el cuadro de la mejor lectura devuelta actualiza la caché y el
+        seguimiento de la sesión.
+        
+        Retorna (códigos, cuadros escaneados).
+        """
+        images = list(images)[:self.config['batch_max_frames']]
+        if not images:
+            return [], 0
+        
+        symbols = self._symbols_for_device(device)
+        symbols_key = self._symbols_key(symbols)
+        stop_on_confident = self.config['batch_stop_on_confident']
+        max_distance = self.config['batch_duplicate_distance']
+        
+        hashes = []
+        source = []         # cuadro -> índice del cuadro que se decodifica en su lugar
+        results = {}        # índice -> códigos (solo cuadros decodificados o en caché)
+        cached = set()
+        for index, image in enumerate(images):
+            try:
+                frame_hash = self._frame_hash(image)
+            except Exception as e:
+                self.logger.error(f"Error escaneando cuadro de la ráfaga: {str(e)}")
+                frame_hash = None
+            hashes.append(frame_hash)
             
-            # Usar preprocesamiento optimizado
-            processed_images = self.preprocess_image_optimized(image)
+            duplicate = None
+            if frame_hash is not None:
+                duplicate = next((other for other in dict.fromkeys(source)
+                                  if hashes[other] is not None and
+                                  bin(hashes[other] ^ frame_hash).count('1') <= max_distance), None)
+            source.append(index if duplicate is None else duplicate)
             
-            self.logger.info(f"Procesando {len(processed_images)} variaciones optimizadas")
+            if duplicate is None and frame_hash is not None and self.config['result_cache']:
+                barcodes = self.result_cache.get(frame_hash, symbols_key)
+                if barcodes is not None:
+                    results[index] = barcodes
+                    cached.add(index)
+        
+        # Decodificar los cuadros distintos que no estaban en caché
+        pending = [index for index in dict.fromkeys(source)
+                   if index not in cached and hashes[index] is not None]
+        if pending and not (stop_on_confident and any(self._quality_reached(b) for b in results.values())):
+            try:
+                decoded = self._decode_frames([images[index] for index in pending], symbols,
+                                              self._get_track(session_id), stop_on_confident)
+            except Exception as e:
+                self.logger.error(f"Error escaneando cuadros de la ráfaga: {str(e)}")
+                decoded = []
+            for index, (barcodes, attempts) in zip(pending, decoded):
+                if attempts:
+                    results[index] = barcodes
+        
+        consensus = {}
+        best_frame = {}     # (tipo, datos) -> cuadro de la mejor lectura
+        scanned = [index for index in range(len(images)) if source[index] in results]
+        for index in scanned:
+            for barcode in results[source[index]]:
+                key = (barcode['type'], barcode['data'])
+                best = consensus.get(key)
+                votes = best['votes'] + 1 if best else 1
+                if best is None or barcode['quality_score'] > best['quality_score']:
+                    best = dict(barcode)
+                    best_frame[key] = source[index]
+                best['votes'] = votes
+                consensus[key] = best
+        
+        barcodes_found = sorted(consensus.values(), key=lambda b: (b['votes'], b['quality_score']), reverse=True)
+        
+        # El cuadro cuya lectura encabeza la respuesta (o el último escaneado,
+        # si no hubo códigos) es el que queda en la caché y guía el seguimiento
+        if scanned:
+            index = (best_frame[(barcodes_found[0]['type'], barcodes_found[0]['data'])]
+                     if barcodes_found else source[scanned[-1]])
+            if index not in cached and self.config['result_cache']:
+                self.result_cache.put(hashes[index], symbols_key, results[index])
+            self._update_track(session_id, self._source_size(images[index]), results[index])
+        
+        self.logger.info(f"Ráfaga escaneada: {len(scanned)}/{len(images)} cuadros "
+                         f"({len(results)} distintos), {len(barcodes_found)} códigos distintos")
+        return barcodes_found, len(scanned)
+    
+    def _get_track(self, session_id):
+        """Último acierto vigente de una sesión, o None"""
+        if not session_id or not self.config['tracking']:
+            return None
+        
+        with self._tracking_lock:
+            track = self.tracking_sessions.get(session_id)
+            if track and time.monotonic() - track['updated'] > self.config['tracking_ttl_seconds']:
+                del self.tracking_sessions[session_id]
+                track = None
+            return track
+    
+    def _update_track(self, session_id, frame_size, barcodes_found):
+        """Recordar caja y método del mejor código de la sesión (o soltar el seguimiento)"""
+        if not session_id or not self.config['tracking']:
+            return
+        
+        with self._tracking_lock:
+            if not barcodes_found:
+                # Seguimiento perdido: el próximo cuadro usa la cascada completa
+                self.tracking_sessions.pop(session_id, None)
+                return
             
-            # Intentar escanear cada versión procesada
-            for i, img in enumerate(processed_images):
-                try:
-                    # pyzbar trabaja directamente con PIL Images
-                    barcodes = pyzbar.decode(img)
-                    
-                    for barcode in barcodes:
-                        # Extraer datos con manejo de encoding mejorado
-                        barcode_data = self._extract_barcode_data(barcode)
-                        
-                        if not barcode_data:
-                            continue
-                        
-                        barcode_type = barcode.type
-                        
-                        # Obtener coordenadas del código
-                        (x, y, w, h) = barcode.rect
-                        
-                        # Calcular calidad del código detectado
-                        quality_score = self._calculate_barcode_quality(barcode, img)
-                        
-                        # Crear objeto resultado
-                        result = {
-                            'data': barcode_data,
-                            'type': barcode_type,
-                            'coordinates': {
-                                'x': x, 'y': y, 
-                                'width': w, 'height': h
-                            },
-                            'polygon': [(point.x, point.y) for point in barcode.polygon],
-                            'processing_method': f'optimized_method_{i}',
-                            'quality_score': quality_score
-                        }
-                        
-                        # Validar código con validación mejorada
-                        if self.validate_barcode_enhanced(barcode_data, barcode_type, quality_score):
-                            # Evitar duplicados
-                            if not any(b['data'] == barcode_data for b in barcodes_found):
-                                barcodes_found.append(result)
-                                self.logger.info(f"Código encontrado: {barcode_type} - {barcode_data} (método {i}, calidad: {quality_score:.2f})")
-                        else:
-                            self.logger.debug(f"Código descartado por baja calidad: {barcode_data} (calidad: {quality_score:.2f})")
+            best = barcodes_found[0]
+            coords = best['coordinates']
+            method = best['processing_method']
+            if method.startswith(self.TRACKED_PREFIX):
+                method = method[len(self.TRACKED_PREFIX):]
+            
+            self.tracking_sessions[session_id] = {
+                'box': (coords['x'], coords['y'], coords['x'] + coords['width'], coords['y'] + coords['height']),
+                'method': method,
+                'frame_size': frame_size,
+                'updated': time.monotonic()
+            }
+            self.tracking_sessions.move_to_end(session_id)
+            
+            while len(self.tracking_sessions) > self.config['tracking_max_sessions']:
+                self.tracking_sessions.popitem(last=False)
+    
+    def _frame_hash(self, image):
+        """Hash perceptual (dHash) del cuadro reducido a escala de grises"""
+        if isinstance(image, tuple):
+            image = self._as_image(image)
+        elif not isinstance(image, Image.Image):
+            image = Image.fromarray(image)
+        
+        size = self.config['cache_hash_size']
+        small = image.resize((size + 1, size), Image.Resampling.BOX, reducing_gap=2.0).convert('L')
+        pixels = np.asarray(small, dtype=np.int16)
+        
+        # Un bit por par de píxeles vecinos: ¿aumenta el brillo hacia la derecha?
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    
+    def get_cache_stats(self):
+        """Contadores de la caché de resultados"""
+        stats = self.result_cache.stats()
+        stats['enabled'] = self.config['result_cache']
+        return stats
+    
+    def _scan_frames_serial(self, frames, symbols=None, stop_on_confident=False):
+        """Decodificar los cuadros uno tras otro en el hilo actual"""
+        for frame in frames:
+            self._scan_variants_serial(frame, symbols)
+            if stop_on_confident and self._quality_reached(frame.barcodes_found):
+                break
+    
+    def _scan_variants_serial(self, frame, symbols=None):
+        """Decodificar las variaciones de un cuadro una a una en el hilo actual"""
+        # Las variaciones se generan bajo demanda: solo se construye la
+        # siguiente si los intentos anteriores no dieron un código de calidad
+        for label, img, transform in frame.variants:
+            frame.attempted.append(label)
+            try:
+                # Tupla (bytes, ancho, alto): pyzbar no convierte ni copia
+                barcodes = pyzbar.decode(img, symbols=symbols)
+                self._collect_barcodes(barcodes, label, frame.frame_size, transform,
+                                       frame.barcodes_found, frame.successful)
                 
-                except Exception as e:
-                    self.logger.debug(f"Error escaneando imagen procesada {i}: {str(e)}")
-                    continue
+            except Exception as e:
+                self.logger.debug(f"Error escaneando variación {label}: {str(e)}")
+                continue
+            
+            # Si ya encontramos códigos de buena calidad, parar procesamiento adicional
+            if self._quality_reached(frame.barcodes_found):
+                break
+        frame.variants.close()
+    
+    def _scan_frames_parallel(self, frames, symbols=None, stop_on_confident=False):
+        """Decodificar lotes disjuntos de variaciones en el pool de procesos
+        
+        Los lotes se toman por turnos de cada cuadro todavía sin código de
+        calidad, con como máximo un lote en vuelo por proceso trabajador. Un
+        cuadro deja de enviar lotes (y se cancelan los suyos pendientes) en
+        cuanto un resultado supera 'quality_threshold'; con
+        'stop_on_confident' se descarta entonces el trabajo de todos.
+        Retorna el tiempo de CPU consumido por los trabajadores.
+        """
+        pool = self._get_decode_pool()
+        batch_size = max(1, int(self.config['parallel_batch_size']))
+        active = deque(frames)      # Cuadros con variaciones por enviar
+        pending = {}                # futuro -> cuadro
+        worker_cpu = 0.0
+        
+        try:
+            while True:
+                # Construir y enviar lotes mientras haya trabajadores libres
+                while active and len(pending) < self._pool_workers:
+                    frame = active[0]
+                    batch = list(itertools.islice(frame.variants, batch_size))
+                    if not batch:
+                        active.popleft()
+                        continue
+                    active.rotate(-1)
+                    payload = []
+                    for label, img, transform in batch:
+                        key = len(frame.variant_info)
+                        frame.variant_info[key] = (label, transform)
+                        payload.append((key,) + self._to_gray_buffer(img))
+                    pending[pool.submit(_decode_variant_batch, payload, symbols)] = frame
                 
-                # Si ya encontramos códigos de buena calidad, parar procesamiento adicional
-                if len(barcodes_found) > 0 and max(b['quality_score'] for b in barcodes_found) > self.config['quality_threshold']:
+                if not pending:
                     break
+                
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    frame = pending.pop(future)
+                    try:
+                        results, batch_cpu = future.result()
+                    except Exception as e:
+                        self.logger.debug(f"Error en lote de decodificación paralela: {str(e)}")
+                        continue
+                    
+                    worker_cpu += batch_cpu
+                    for key, _size, barcodes in results:
+                        label, transform = frame.variant_info[key]
+                        frame.attempted.append(label)
+                        self._collect_barcodes(barcodes, label, frame.frame_size, transform,
+                                               frame.barcodes_found, frame.successful)
+                
+                # Código de calidad encontrado: descartar el trabajo restante del cuadro
+                confident = [frame for frame in frames if self._quality_reached(frame.barcodes_found)]
+                if stop_on_confident and confident:
+                    confident = frames
+                for frame in confident:
+                    if frame in active:
+                        active.remove(frame)
+                    for future in [f for f, owner in pending.items() if owner is frame]:
+                        future.cancel()
+                        del pending[future]
+        finally:
+            for frame in frames:
+                frame.variants.close()
+        
+        return worker_cpu
+    
+    def _symbols_for_device(self, device=None):
+        """Simbologías de zbar a habilitar para un dispositivo (None = todas)"""
+        names = self.config['enabled_symbologies']
+        
+        profile = self.config['device_profiles'].get(device) if device else None
+        if profile and 'enabled_symbologies' in profile:
+            names = profile['enabled_symbologies']
+        
+        if not names:
+            return None
+        
+        # validate_symbologies garantiza al menos una que zbar decodifica
+        symbols = [self.SYMBOLOGY_MAP[name.upper()] for name in names]
+        return [symbol for symbol in symbols if symbol is not None]
+    
+    def validate_symbologies(self, names):
+        """Verificar una lista de simbologías
+        
+        Lanza ValueError si alguna no existe o si ninguna la decodifica zbar
+        (la lista no puede acabar habilitando todas).
+        """
+        if names is None:
+            return
+        
+        if not isinstance(names, (list, tuple)) or not all(isinstance(name, str) for name in names):
+            raise ValueError("enabled_symbologies debe ser una lista de formatos")
+        
+        unknown = [name for name in names if name.upper() not in self.SYMBOLOGY_MAP]
+        if unknown:
+            raise ValueError(f"Simbologías no soportadas: {', '.join(unknown)}")
+        
+        unsupported = [name for name in names if self.SYMBOLOGY_MAP[name.upper()] is None]
+        if names and len(unsupported) == len(names):
+            raise ValueError(f"zbar no decodifica ninguna de: {', '.join(names)}")
+        if unsupported:
+            self.logger.warning(f"zbar no decodifica {', '.join(unsupported)}; se ignorarán")
+    
+    def _to_gray_buffer(self, image):
+        """Convertir una imagen a (bytes, ancho, alto) en escala de grises de 8 bits"""
+        if isinstance(image, tuple):
+            return image
+        if image.mode != 'L':
+            image = image.convert('L')
+        return (image.tobytes(), image.width, image.height)
+    
+    def _get_decode_pool(self):
+        """Obtener (creándolo la primera vez) el pool persistente de procesos"""
+        with self._pool_lock:
+            if self._decode_pool is None:
+                workers = self.config['parallel_workers'] or os.cpu_count() or 1
+                # 'spawn' evita heredar por fork los hilos y locks del servidor.
+                # Cada proceso nuevo reimporta el módulo principal como
+                # __mp_main__: server_https no crea sus componentes en ese caso
+                self._decode_pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pool_workers = workers
+                self.logger.info(f"Pool de decodificación paralela iniciado con {workers} procesos")
+            return self._decode_pool
+    
+    def shutdown_decode_pool(self):
+        """Detener el pool de procesos de decodificación paralela"""
+        with self._pool_lock:
+            pool, self._decode_pool = self._decode_pool, None
+            self._pool_workers = 0
+        
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.logger.info("Pool de decodificación paralela detenido")
+    
+    def _collect_barcodes(self, barcodes, label, frame_size, transform, barcodes_found, successful):
+        """Validar los códigos decodificados de una variación y agregarlos al resultado
+        
+        'transform' lleva las coordenadas de la variación al cuadro original,
+        de tamaño 'frame_size'.
+        """
+        for barcode in barcodes:
+            # Extraer datos con manejo de encoding mejorado
+            barcode_data = self._extract_barcode_data(barcode)
             
-            # Ordenar por calidad y retornar los mejores
-            barcodes_found.sort(key=lambda x: x['quality_score'], reverse=True)
+            if not barcode_data:
+                continue
             
-            self.logger.info(f"Escaneo completado. Códigos de calidad encontrados: {len(barcodes_found)}")
-            return barcodes_found
+            barcode_type = barcode.type
+            
+            # Obtener coordenadas del código en el cuadro original
+            (x, y, w, h) = self._map_rect(barcode.rect, transform)
+            polygon = [tuple(round(v) for v in _apply_transform(transform, point.x, point.y))
+                       for point in barcode.polygon]
+            
+            # Calcular calidad respecto al cuadro original, no al recorte o
+            # variación donde se leyó
+            quality_score = self._calculate_barcode_quality(barcode, (w, h), frame_size)
+            
+            # Crear objeto resultado
+            result = {
+                'data': barcode_data,
+                'type': barcode_type,
+                'coordinates': {
+                    'x': x, 'y': y, 
+                    'width': w, 'height': h
+                },
+                'polygon': polygon,
+                'processing_method': label,
+                'quality_score': quality_score
+            }
+            
+            # Validar código con validación mejorada
+            if self.validate_barcode_enhanced(barcode_data, barcode_type, quality_score):
+                # Evitar duplicados
+                if not any(b['data'] == barcode_data for b in barcodes_found):
+                    barcodes_found.append(result)
+                    successful.add(label)
+                    self.logger.info(f"Código encontrado: {barcode_type} - {barcode_data} (método {label}, calidad: {quality_score:.2f})")
+            else:
+                self.logger.debug(f"Código descartado por baja calidad: {barcode_data} (calidad: {quality_score:.2f})")
+    
+    def _map_rect(self, rect, transform):
+        """Caja envolvente (x, y, ancho, alto) de un rectángulo transformado"""
+        (x, y, w, h) = rect
+        if transform == _IDENTITY_TRANSFORM:
+            return (x, y, w, h)
+        
+        corners = [_apply_transform(transform, cx, cy)
+                   for cx, cy in ((x, y), (x + w, y), (x, y + h), (x + w, y + h))]
+        xs = [point[0] for point in corners]
+        ys = [point[1] for point in corners]
+        return (round(min(xs)), round(min(ys)),
+                round(max(xs) - min(xs)), round(max(ys) - min(ys)))
+    
+    def _quality_reached(self, barcodes_found):
+        """Indica si ya hay un código que supera el umbral de calidad"""
+        return len(barcodes_found) > 0 and max(b['quality_score'] for b in barcodes_found) > self.config['quality_threshold']
+    
+    def _record_scan_timing(self, start_wall, start_cpu, worker_cpu, attempts):
+        """Guardar tiempo real vs. tiempo de CPU del último escaneo"""
+        wall_ms = (time.perf_counter() - start_wall) * 1000
+        main_cpu_ms = (time.process_time() - start_cpu) * 1000
+        worker_cpu_ms = worker_cpu * 1000
+        
+        self.last_scan_timing = {
+            'parallel': self.config['parallel_decoding'],
+            'attempts': attempts,
+            'wall_ms': round(wall_ms, 2),
+            'cpu_ms': round(main_cpu_ms + worker_cpu_ms, 2),
+            'main_cpu_ms': round(main_cpu_ms, 2),
+            'worker_cpu_ms': round(worker_cpu_ms, 2)
+        }
+        
+        self.logger.info(f"Tiempo de escaneo: {wall_ms:.1f} ms reales, "
+                         f"{main_cpu_ms + worker_cpu_ms:.1f} ms de CPU ({attempts} intentos)")
+    
+    def _record_scan_outcome(self, attempted, successful):
+        """Actualizar las tasas de acierto por método con decaimiento exponencial"""
+        decay = self.config['stats_decay']
+        
+        with self._stats_lock:
+            # Envejecer todo el historial para que pese más lo reciente
+            for stats in itertools.chain(self.method_stats.values(), self._saved_stats.values()):
+                stats['hits'] *= decay
+                stats['attempts'] *= decay
+            
+            for label in attempted:
+                stats = self.method_stats.setdefault(label, {'hits': 0.0, 'attempts': 0.0})
+                stats['attempts'] += 1
+                if label in successful:
+                    stats['hits'] += 1
+            
+            self.scans_recorded += 1
+            self._scans_since_save += 1
+            should_save = self._scans_since_save >= self.config['stats_save_interval']
+        
+        if should_save:
+            self.save_method_stats()
+    
+    def _read_method_stats(self, stats_file):
+        """Leer (estadísticas por método, escaneos registrados) de disco; vacío si no existe"""
+        if not os.path.exists(stats_file):
+            return {}, 0
+        
+        with open(stats_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        method_stats = {}
+        for label, values in data.get('method_stats', {}).items():
+            # Las etiquetas retiradas suman sus aciertos a la que las reemplaza
+            stats = method_stats.setdefault(self.RENAMED_VARIANTS.get(label, label),
+                                            {'hits': 0.0, 'attempts': 0.0})
+            stats['hits'] += float(values['hits'])
+            stats['attempts'] += float(values['attempts'])
+        return method_stats, int(data.get('scans_recorded', 0))
+    
+    def load_method_stats(self):
+        """Cargar las estadísticas por método guardadas en disco"""
+        stats_file = self.config.get('stats_file')
+        if not stats_file or not os.path.exists(stats_file):
+            return False
+        
+        try:
+            method_stats, scans_recorded = self._read_method_stats(stats_file)
+            
+            with self._stats_lock:
+                self.method_stats = method_stats
+                self.scans_recorded = scans_recorded
+                self._saved_stats = {label: dict(values) for label, values in method_stats.items()}
+                self._saved_scans = scans_recorded
+            
+            self.logger.info(f"Estadísticas de métodos cargadas: {len(method_stats)} métodos")
+            return True
             
         except Exception as e:
-            self.logger.error(f"Error general en scan_image optimizado: {str(e)}")
-            return []
+            self.logger.warning(f"No se pudieron cargar estadísticas de métodos: {e}")
+            return False
+    
+    def save_method_stats(self):
+        """Guardar las estadísticas por método en disco (escritura atómica)
+        
+        Varios procesos (modo producción) comparten el archivo: bajo un
+        bloqueo entre procesos se relee y se le suma lo aprendido aquí desde
+        el último guardado, en lugar de sobrescribir lo de los demás.
+        """
+        stats_file = self.config.get('stats_file')
+        if not stats_file:
+            return False
+        
+        with self._stats_lock:
+            self._scans_since_save = 0
+            
+            # Temporal único en el mismo directorio: otros hilos o procesos que
+            # guardan a la vez no escriben sobre el mismo archivo
+            temp_file = None
+            try:
+                with _file_lock(f"{stats_file}.lock"):
+                    merged, scans_recorded = self._read_method_stats(stats_file)
+                    for label, values in self.method_stats.items():
+                        saved = self._saved_stats.get(label, {'hits': 0.0, 'attempts': 0.0})
+                        stats = merged.setdefault(label, {'hits': 0.0, 'attempts': 0.0})
+                        stats['hits'] = max(0.0, stats['hits'] + values['hits'] - saved['hits'])
+                        stats['attempts'] = max(0.0, stats['attempts'] + values['attempts'] - saved['attempts'])
+                    scans_recorded += self.scans_recorded - self._saved_scans
+                    
+                    fd, temp_file = tempfile.mkstemp(prefix=f"{os.path.basename(stats_file)}.",
+                                                     suffix='.tmp', dir=os.path.dirname(stats_file) or '.')
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        json.dump({'method_stats': merged, 'scans_recorded': scans_recorded}, f, indent=2)
+                    os.replace(temp_file, stats_file)
+                
+            except Exception as e:
+                self.logger.warning(f"No se pudieron guardar estadísticas de métodos: {e}")
+                if temp_file and os.path.exists(temp_file):
+                    os.remove(temp_file)
+                return False
+            
+            # Adoptar el total combinado: también ordena por lo que aprendieron los demás
+            self.method_stats = merged
+            self.scans_recorded = scans_recorded
+            self._saved_stats = {label: dict(values) for label, values in merged.items()}
+            self._saved_scans = scans_recorded
+            return True
     
     def _extract_barcode_data(self, barcode):
         """Extraer datos del código con manejo mejorado de encoding"""
@@ -382,15 +1509,18 @@ class BarcodeScanner:
                     # Último recurso: ignorar caracteres problemáticos
                     return barcode.data.decode('utf-8', errors='ignore')
     
-    def _calculate_barcode_quality(self, barcode, image):
-        """Calcular puntuación de calidad del código detectado"""
+    def _calculate_barcode_quality(self, barcode, barcode_size, image_size):
+        """Calcular puntuación de calidad del código detectado
+        
+        'barcode_size' e 'image_size' deben estar en la misma escala.
+        """
         try:
             quality_score = 1.0
             
             # Factor 1: Tamaño del código (códigos más grandes suelen ser más confiables)
-            (x, y, w, h) = barcode.rect
+            (w, h) = barcode_size
             area = w * h
-            img_area = image.size[0] * image.size[1]
+            img_area = image_size[0] * image_size[1]
             size_ratio = area / img_area
             
             if size_ratio > 0.01:  # Al menos 1% de la imagen
@@ -500,22 +1630,141 @@ class BarcodeScanner:
         return self.supported_formats
     
     def update_config(self, new_config):
-        """Actualizar configuración del scanner"""
+        """Actualizar configuración del scanner
+        
+        Lanza ValueError si las simbologías (globales o de un perfil) no son válidas.
+        """
+        if 'enabled_symbologies' in new_config:
+            self.validate_symbologies(new_config['enabled_symbologies'])
+        
+        if 'resize_filter' in new_config and new_config['resize_filter'] not in Image.Resampling.__members__:
+            raise ValueError(f"resize_filter debe ser uno de: {', '.join(Image.Resampling.__members__)}")
+        
+        if 'device_profiles' in new_config:
+            profiles = new_config['device_profiles']
+            if not isinstance(profiles, dict):
+                raise ValueError("device_profiles debe ser un objeto {dispositivo: perfil}")
+            for profile in profiles.values():
+                if not isinstance(profile, dict):
+                    raise ValueError("Cada perfil de dispositivo debe ser un objeto")
+                unknown = [key for key in profile if key != 'enabled_symbologies']
+                if unknown:
+                    raise ValueError(f"Opciones de perfil desconocidas: {', '.join(map(str, unknown))}")
+                self.validate_symbologies(profile.get('enabled_symbologies'))
+        
+        pool_settings = (self.config['parallel_decoding'], self.config['parallel_workers'])
         self.config.update(new_config)
+        
+        # Reiniciar el pool si se desactivó el modo paralelo o cambió el número de procesos
+        if (self.config['parallel_decoding'], self.config['parallel_workers']) != pool_settings:
+            self.shutdown_decode_pool()
+        
+        # Los resultados en caché pueden no valer con la nueva configuración
+        self.result_cache.max_entries = self.config['cache_max_entries']
+        self.result_cache.ttl_seconds = self.config['cache_ttl_seconds']
+        self.result_cache.max_distance = self.config['cache_max_distance']
+        self.result_cache.clear()
+        
         self.logger.info("Configuración del scanner optimizado actualizada")
     
     def get_config(self):
         """Obtener configuración actual"""
         return self.config
     
+    def get_capture_profile(self):
+        """Resolución, recorte y calidad JPEG que conviene enviar a scan_image
+        
+        Los clientes recortan a la guía de apuntado y reducen el cuadro antes
+        de subirlo; todo píxel por encima de max_width/max_height se
+        descartaría de todos modos en _smart_resize.
+        """
+        levels = self.config['capture_levels']
+        with self._capture_lock:
+            level = min(self.capture_level, len(levels) - 1)
+        
+        spec = levels[level]
+        return {
+            'level': level,
+            'levels': len(levels),
+            'max_width': min(spec['max_width'], self.config['max_width']),
+            'max_height': self.config['max_height'],
+            'jpeg_quality': spec['jpeg_quality'],
+            'crop_margin': spec['crop_margin'],
+            'adaptive': self.config['capture_adaptive']
+        }
+    
+    def record_capture_outcome(self, level, barcodes, manual=False):
+        """Ajustar el nivel del perfil de captura según los resultados medidos
+        
+        Una lectura es "fácil" si sale de una variación de cuadro completo con
+        calidad sobre quality_threshold: el cuadro traía píxeles de sobra.
+        Las lecturas difíciles y los fallos de escaneos manuales (el usuario
+        apuntaba a un código) indican que faltan píxeles o margen. Los fallos
+        del escaneo continuo no cuentan: casi siempre no hay código a la vista.
+        """
+        if not self.config['capture_adaptive'] or (not barcodes and not manual):
+            return
+        
+        method = barcodes[0]['processing_method'] if barcodes else ''
+        if method.startswith(self.TRACKED_PREFIX):
+            method = method[len(self.TRACKED_PREFIX):]
+        easy = method in self.FULL_FRAME_VARIANTS and self._quality_reached(barcodes[:1])
+        
+        with self._capture_lock:
+            # Resultados de clientes con un perfil viejo no cuentan
+            if level != self.capture_level:
+                return
+            
+            self.capture_samples += 1
+            self.capture_easy += easy
+            
+            min_samples = self.config['capture_min_samples']
+            ratio = self.capture_easy / self.capture_samples
+            new_level = self.capture_level
+            if self.capture_samples >= min_samples and ratio < self.config['capture_raise_below']:
+                new_level = min(self.capture_level + 1, len(self.config['capture_levels']) - 1)
+            elif self.capture_samples >= 2 * min_samples and ratio > self.config['capture_lower_above']:
+                new_level = max(self.capture_level - 1, 0)
+            elif self.capture_samples < 2 * min_samples:
+                return
+            
+            # Nueva ventana de medición
+            self.capture_samples = 0
+            self.capture_easy = 0
+            if new_level == self.capture_level:
+                return
+            self.capture_level = new_level
+        
+        self.logger.info(f"Perfil de captura: nivel {new_level} (lecturas fáciles {ratio:.0%})")
+    
     def get_processing_stats(self):
         """Obtener estadísticas de procesamiento"""
+        with self._stats_lock:
+            method_stats = {
+                label: {
+                    'hits': round(values['hits'], 3),
+                    'attempts': round(values['attempts'], 3),
+                    'hit_rate': round(self._method_score(label), 3)
+                }
+                for label, values in self.method_stats.items()
+            }
+            scans_recorded = self.scans_recorded
+        
         return {
             'supported_formats': len(self.supported_formats),
             'max_processing_attempts': self.config['max_processing_attempts'],
             'quality_threshold': self.config['quality_threshold'],
             'optimizations_enabled': sum(1 for key, value in self.config.items() 
-                                       if key.endswith('_processing') or key.endswith('_enhancement') and value)
+                                       if key.endswith('_processing') or key.endswith('_enhancement') and value),
+            'adaptive_ordering': self.config['adaptive_ordering'],
+            'variant_order': [entry[0] for entry in self._ordered_variant_catalog()],
+            'scans_recorded': scans_recorded,
+            'method_stats': method_stats,
+            'parallel_decoding': self.config['parallel_decoding'],
+            'parallel_workers': self._pool_workers,
+            'tracked_sessions': len(self.tracking_sessions),
+            'capture_level': self.capture_level,
+            'last_scan_timing': self.last_scan_timing
         }
     
     def test_scanner(self):
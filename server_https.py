@@ -19,24 +19,74 @@ if os.name == 'nt':  # Windows
 from scanner import BarcodeScanner
 from keyboard_sim import KeyboardSimulator
 from database import ImageDatabase
+from event_broker import EventBroker
+from scan_queue import ScanScheduler, ScanJob
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, url_for, has_request_context
+from PIL import Image
+import argparse
 import base64
+import binascii
 import io
-from PIL import Image
+import json
 import threading
 import time
 import socket
 import ssl
 import os
-from datetime import datetime, timedelta
+import tempfile
+from datetime import datetime, timedelta, timezone
 
 app = Flask(__name__)
 
-# Inicializar componentes
-scanner = BarcodeScanner()
-keyboard = KeyboardSimulator()
-image_db = ImageDatabase()
+# Subidas de imágenes: límite por petición y tamaño a partir del cual el
+# cuerpo binario se vuelca a un archivo temporal en lugar de la memoria
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Errores de una subida que no es una imagen legible (base64 corrupto, datos
+# que PIL no reconoce o truncados; UnidentifiedImageError es un OSError)
+INVALID_IMAGE_ERRORS = (binascii.Error, ValueError, OSError)
+
+# Escaneos: hilos trabajadores fijos, trabajos en espera como máximo y
+# segundos que /scan espera el resultado antes de responder con el job_id
+SCAN_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+SCAN_QUEUE_SIZE = 16
+SCAN_WAIT_SECONDS = 20
+
+# Modo producción: archivo donde /config deja la configuración para que la
+# lean todos los procesos (None = un solo proceso, no se comparte)
+SHARED_CONFIG_PATH = os.environ.get('SCANNER_SHARED_CONFIG')
+SHARED_CONFIG_KEYS = ('auto_type', 'add_enter')
+
+# Opciones del scanner que /config acepta; el resto (rutas, pools, cachés)
+# solo se cambia desde el código
+SCANNER_CONFIG_KEYS = ('enabled_symbologies', 'device_profiles')
+
+# Módulos de la aplicación que cada proceso de gunicorn vuelve a importar
+APP_MODULES = ('scanner', 'keyboard_sim', 'database', 'event_broker', 'scan_queue')
+
+# Varios procesos pre-fork: trabajos, eventos, seguimiento y nivel de captura
+# viven en la memoria de cada proceso, así que lo que dependa de volver al
+# mismo proceso (consultar un job_id, flujo SSE, perfil adaptativo) se apaga
+MULTIPROCESS = os.environ.get('SCANNER_MULTIPROCESS') == '1'
+
+# Componentes del servidor (los crea init_components al final del módulo)
+scanner = keyboard = image_db = event_broker = scan_scheduler = None
+
+def on_scan_job_done(job):
+    """Avisar por SSE del resultado de un trabajo de escaneo"""
+    event_broker.publish('escaneo_trabajo', job.to_dict())
+
+def fix_capture_profile():
+    """Perfil de captura fijo en el nivel más completo (modo multiproceso)
+    
+    Con un nivel adaptativo distinto en cada proceso los clientes
+    recargarían el perfil a cada respuesta.
+    """
+    scanner.update_config({'capture_adaptive': False})
+    scanner.capture_level = len(scanner.get_config()['capture_levels']) - 1
 
 def safe_print(message):
     """Función auxiliar para imprimir mensajes de forma segura en cualquier codificación"""
@@ -56,6 +106,48 @@ CONFIG = {
     'add_enter': True
 }
 
+_shared_config_mtime = None
+
+def save_shared_config():
+    """Publicar la configuración actual para los demás procesos"""
+    if not SHARED_CONFIG_PATH:
+        return
+    
+    shared = {
+        'server': {key: CONFIG[key] for key in SHARED_CONFIG_KEYS},
+        'scanner': {key: scanner.get_config()[key] for key in SCANNER_CONFIG_KEYS}
+    }
+    # Escritura atómica: ningún proceso lee un archivo a medias
+    temp_path = f"{SHARED_CONFIG_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(shared, f, indent=2, default=list)
+    os.replace(temp_path, SHARED_CONFIG_PATH)
+
+@app.before_request
+def load_shared_config():
+    """Aplicar la configuración compartida si otro proceso la cambió"""
+    global _shared_config_mtime
+    if not SHARED_CONFIG_PATH:
+        return
+    
+    try:
+        mtime = os.stat(SHARED_CONFIG_PATH).st_mtime_ns
+        if mtime == _shared_config_mtime:
+            return
+        with open(SHARED_CONFIG_PATH, encoding='utf-8') as f:
+            shared = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ No se pudo leer la configuración compartida: {e}")
+        return
+    
+    _shared_config_mtime = mtime
+    CONFIG.update({key: value for key, value in shared.get('server', {}).items() if key in SHARED_CONFIG_KEYS})
+    try:
+        scanner.update_config({key: value for key, value in shared.get('scanner', {}).items()
+                               if key in SCANNER_CONFIG_KEYS})
+    except ValueError as e:
+        print(f"⚠️ Configuración de scanner compartida no válida: {e}")
+
 def create_self_signed_cert():
     """Crear certificado autofirmado para HTTPS"""
     try:
@@ -184,85 +276,307 @@ def index():
     """Página principal con interfaz de escaneo"""
     return render_template('scanner.html')
 
+def read_upload(image_field):
+    """Leer los campos y la imagen de una subida
+    
+    Acepta tres formatos:
+    - multipart/form-data: la imagen en el archivo 'image_field' y los
+      demás datos como campos del formulario
+    - cuerpo binario (image/jpeg, image/png...): los datos en la URL
+      (?codigo=...&dispositivo=...)
+    - JSON con la imagen como data URL base64 (formato anterior)
+    
+    Devuelve (campos, archivo) con la imagen como archivo binario ya
+    posicionado al inicio, o None si la petición no trae imagen.
+    """
+    if request.mimetype == 'multipart/form-data':
+        # Werkzeug ya vuelca a disco los archivos grandes mientras los recibe
+        upload = request.files.get(image_field)
+        return request.form.to_dict(), (upload.stream if upload else None)
+    
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+        while True:
+            chunk = request.stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            spool.write(chunk)
+        
+        if spool.tell() == 0:
+            spool.close()
+            return request.args.to_dict(), None
+        
+        spool.seek(0)
+        return request.args.to_dict(), spool
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return {}, None
+    if image_field not in data:
+        return data, None
+    
+    return data, decode_data_url(data[image_field])
+
+def decode_data_url(image_data):
+    """Archivo en memoria con una imagen base64 (con o sin prefijo data:image/...;base64,)
+    
+    Lanza ValueError o binascii.Error si no es base64 válido.
+    """
+    if not isinstance(image_data, str):
+        raise ValueError("la imagen debe ser una cadena base64")
+    if image_data.startswith('data:'):
+        image_data = image_data.split(',', 1)[-1]
+    return io.BytesIO(base64.b64decode(image_data))
+
+def read_frame_uploads(frames_field):
+    """Leer varios cuadros de una subida (multipart con varios archivos
+    'frames_field', o JSON con una lista de data URLs base64)
+    
+    Devuelve (campos, [imágenes PIL ya decodificadas]).
+    """
+    if request.mimetype == 'multipart/form-data':
+        data = request.form.to_dict()
+        files = [upload.stream for upload in request.files.getlist(frames_field)]
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return {}, []
+        frames = data.get(frames_field) or []
+        if not isinstance(frames, list):
+            raise ValueError(f"{frames_field} debe ser una lista de imágenes")
+        files = [decode_data_url(frame) for frame in frames]
+    
+    images = []
+    for image_file in files[:scanner.get_config()['batch_max_frames']]:
+        with image_file:
+            images.append(scanner.load_image(image_file))
+    return data, images
+
+def invalid_image_response(error):
+    """Respuesta 400 para una subida que no es una imagen legible"""
+    print(f"⚠️ Imagen no válida: {error}")
+    return jsonify({'error': 'Imagen no válida'}), 400
+
+def capture_level_of(data):
+    """Nivel del perfil de captura con que el cliente preparó la subida (o None)"""
+    try:
+        return int(data['perfil_nivel'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def process_scan(image, device=None, session_id=None, capture_level=None):
+    """Escanear un cuadro y preparar la respuesta de /scan (corre en un trabajador)"""
+    # Escanear códigos de barras (con el perfil del dispositivo y el
+    # seguimiento de la sesión del cliente, si existen)
+    barcodes = scanner.scan_image(image, device=device, session_id=session_id)
+    if capture_level is not None:
+        scanner.record_capture_outcome(capture_level, barcodes)
+    return scan_result(barcodes, device)
+
+def process_scan_batch(images, device=None, session_id=None, capture_level=None):
+    """Escanear una ráfaga de cuadros y preparar la respuesta de /scan/batch"""
+    barcodes, scanned = scanner.scan_batch(images, device=device, session_id=session_id)
+    if capture_level is not None:
+        # La ráfaga es un escaneo manual: sus fallos también cuentan
+        scanner.record_capture_outcome(capture_level, barcodes, manual=True)
+    return {**scan_result(barcodes, device), 'frames': len(images), 'frames_scanned': scanned}
+
+def scan_result(barcodes, device=None):
+    """Publicar y auto-escribir el primer código encontrado; respuesta de /scan"""
+    if not barcodes:
+        return {
+            'success': False,
+            'message': 'No se encontraron códigos de barras',
+            'barcodes': [],
+            'capture_level': scanner.capture_level
+        }
+    
+    # Procesar el primer código encontrado
+    barcode_data = barcodes[0]
+    code_value = barcode_data['data']
+    code_type = barcode_data['type']
+    
+    event_broker.publish('escaneo', {
+        'codigo': code_value,
+        'tipo': code_type,
+        'dispositivo': device,
+        'timestamp': datetime.now().isoformat(sep=' ')
+    })
+    
+    # Auto-escribir si está habilitado
+    if CONFIG['auto_type']:
+        def type_code():
+            # Pequeña pausa para que la respuesta llegue al navegador
+            time.sleep(0.2)
+            
+            # Usar el workflow completo con gestión de foco
+            success = keyboard.scan_and_type_workflow(code_value)
+            
+            if CONFIG['add_enter'] and success:
+                # Pequeña pausa antes del Enter
+                time.sleep(0.1)
+                keyboard.press_enter()
+            
+            if success:
+                print(f"✅ Código {code_type} escrito correctamente: {code_value}")
+            else:
+                print(f"⚠️ Problemas escribiendo código: {code_value}")
+        
+        threading.Thread(target=type_code, daemon=True).start()
+    
+    return {
+        'success': True,
+        'message': f'Código {code_type} escaneado correctamente',
+        'barcodes': barcodes,
+        'auto_typed': CONFIG['auto_type'],
+        'focus_managed': keyboard.get_status().get('focus_management', False),
+        'capture_level': scanner.capture_level   # Si cambió, el cliente recarga el perfil
+    }
+
+def scan_job_response(job):
+    """Respuesta 202 con el trabajo pendiente y dónde consultarlo"""
+    return jsonify({**job.to_dict(), 'url': url_for('scan_job_api', job_id=job.id)}), 202
+
+def busy_response():
+    """Respuesta 503 con Retry-After según la cola de escaneos"""
+    retry_after = scan_scheduler.retry_after()
+    response = jsonify({
+        'success': False,
+        'error': 'Servidor ocupado, reintente en unos segundos',
+        'retry_after': retry_after
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def enqueue_scan(data, function):
+    """Encolar un escaneo y responder según el modo (espera, async o cola llena)
+    
+    Sin async=1 se espera el resultado hasta SCAN_WAIT_SECONDS; si no llega
+    se responde 503 con Retry-After, igual que con la cola llena. En modo
+    multiproceso se ignora async=1: la consulta del job_id podría llegar a
+    otro proceso.
+    """
+    device = data.get('dispositivo')
+    session_id = data.get('session_id')
+    
+    # Turnos por cliente: la sesión identifica a cada teléfono
+    job = scan_scheduler.submit(session_id or device or request.remote_addr, function)
+    if job is None:
+        return busy_response()
+    
+    if not MULTIPROCESS and str(data.get('async', '')).lower() in ('1', 'true'):
+        return scan_job_response(job)
+    
+    if not job.done.wait(SCAN_WAIT_SECONDS):
+        # Si aún no empezó, no se procesa: nadie va a recoger el resultado
+        scan_scheduler.cancel(job)
+        return busy_response()
+    
+    if job.status == ScanJob.FAILED:
+        return jsonify({'error': 'Error al procesar imagen'}), 500
+    
+    return jsonify(job.result)
+
 @app.route('/scan', methods=['POST'])
 def scan_barcode():
-    """Endpoint para procesar imágenes y extraer códigos de barras"""
+    """Endpoint para procesar imágenes y extraer códigos de barras
+    
+    El escaneo se encola en scan_scheduler. Por defecto la petición espera
+    el resultado; con async=1 responde enseguida con un job_id que se
+    consulta en /scan/<job_id> o llega como evento 'escaneo_trabajo' en
+    /api/eventos (no en modo multiproceso). Si el resultado tarda más de
+    SCAN_WAIT_SECONDS responde 503 con Retry-After.
+    """
     try:
-        data = request.get_json()
+        data, image_file = read_upload('image')
         
-        if 'image' not in data:
+        if image_file is None:
             return jsonify({'error': 'No se encontró imagen en la petición'}), 400
         
-        # Decodificar imagen base64
-        image_data = data['image'].split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        
-        # Convertir a PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Escanear códigos de barras
-        barcodes = scanner.scan_image(image)
-        
-        if not barcodes:
-            return jsonify({
-                'success': False,
-                'message': 'No se encontraron códigos de barras',
-                'barcodes': []
-            })
-        
-        # Procesar el primer código encontrado
-        barcode_data = barcodes[0]
-        code_value = barcode_data['data']
-        code_type = barcode_data['type']
-        
-        # Auto-escribir si está habilitado
-        if CONFIG['auto_type']:
-            def type_code():
-                # Pequeña pausa para que la respuesta llegue al navegador
-                time.sleep(0.2)
-                
-                # Usar el workflow completo con gestión de foco
-                success = keyboard.scan_and_type_workflow(code_value)
-                
-                if CONFIG['add_enter'] and success:
-                    # Pequeña pausa antes del Enter
-                    time.sleep(0.1)
-                    keyboard.press_enter()
-                
-                if success:
-                    print(f"✅ Código {code_type} escrito correctamente: {code_value}")
-                else:
-                    print(f"⚠️ Problemas escribiendo código: {code_value}")
-            
-            threading.Thread(target=type_code, daemon=True).start()
-        
-        return jsonify({
-            'success': True,
-            'message': f'Código {code_type} escaneado correctamente',
-            'barcodes': barcodes,
-            'auto_typed': CONFIG['auto_type'],
-            'focus_managed': keyboard.get_status().get('focus_management', False)
-        })
+        # Decodificación directa a la escala de trabajo (JPEG) y orientación EXIF,
+        # leyendo del archivo recibido sin copias intermedias
+        with image_file:
+            image = scanner.load_image(image_file)
+    except INVALID_IMAGE_ERRORS as e:
+        return invalid_image_response(e)
+    
+    try:
+        return enqueue_scan(data, lambda: process_scan(image, data.get('dispositivo'),
+                                                       data.get('session_id'), capture_level_of(data)))
         
     except Exception as e:
         print(f"Error al procesar imagen: {str(e)}")
-        return jsonify({'error': f'Error al procesar imagen: {str(e)}'}), 500
+        return jsonify({'error': 'Error al procesar imagen'}), 500
+
+@app.route('/scan/batch', methods=['POST'])
+def scan_batch():
+    """Escanear una ráfaga de cuadros (3-5 capturas seguidas) en una sola petición
+    
+    Los cuadros van como varios archivos 'frames' (multipart) o como una
+    lista 'frames' de data URLs (JSON). La respuesta es la de /scan más
+    'frames' y 'frames_scanned'; cada código incluye 'votes'. Mismos modos
+    que /scan (espera, async=1, 503 con la cola llena).
+    """
+    try:
+        data, images = read_frame_uploads('frames')
+    except INVALID_IMAGE_ERRORS as e:
+        return invalid_image_response(e)
+    
+    if not images:
+        return jsonify({'error': 'No se encontraron cuadros en la petición'}), 400
+    
+    try:
+        return enqueue_scan(data, lambda: process_scan_batch(images, data.get('dispositivo'),
+                                                             data.get('session_id'), capture_level_of(data)))
+        
+    except Exception as e:
+        print(f"Error al procesar ráfaga: {str(e)}")
+        return jsonify({'error': 'Error al procesar ráfaga'}), 500
+
+@app.route('/scan/<job_id>')
+def scan_job_api(job_id):
+    """Estado o resultado de un trabajo de escaneo asíncrono"""
+    job = scan_scheduler.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o caducado'}), 404
+    
+    return jsonify(job.to_dict())
+
+@app.route('/api/perfil-captura')
+def perfil_captura_api():
+    """Resolución, recorte a la guía y calidad JPEG recomendados para subir cuadros
+    
+    El nivel se ajusta solo según las lecturas medidas; las respuestas de
+    /scan traen 'capture_level' para saber cuándo volver a consultarlo.
+    """
+    response = jsonify(scanner.get_capture_profile())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/guardar-imagen', methods=['POST'])
 def guardar_imagen():
     """Endpoint para guardar imagen asociada a código"""
     try:
-        data = request.get_json()
+        data, image_file = read_upload('imagen')
         
-        if 'codigo' not in data or 'imagen' not in data:
+        if 'codigo' not in data or image_file is None:
             return jsonify({'error': 'Faltan datos: código e imagen requeridos'}), 400
         
+        with image_file:
+            imagen = image_file.read()
+        
+        # Solo se lee la cabecera: basta para rechazar lo que no es una imagen
+        Image.open(io.BytesIO(imagen)).close()
+    except INVALID_IMAGE_ERRORS as e:
+        return invalid_image_response(e)
+    
+    try:
         codigo = data['codigo']
-        imagen_base64 = data['imagen']
         dispositivo = data.get('dispositivo', 'Scanner Web')
         
-        # Guardar en base de datos
-        success = image_db.save_image(codigo, imagen_base64, dispositivo)
+        # Guardar en base de datos (bytes tal cual, sin pasar por base64)
+        success = image_db.save_image(codigo, imagen, dispositivo)
         
         if success:
             return jsonify({
@@ -278,18 +592,105 @@ def guardar_imagen():
             
     except Exception as e:
         print(f"Error guardando imagen: {str(e)}")
-        return jsonify({'error': f'Error guardando imagen: {str(e)}'}), 500
+        return jsonify({'error': 'Error guardando imagen'}), 500
 
 @app.route('/buscar')
 def buscar_page():
     """Página de búsqueda de imágenes por código"""
     return render_template('buscar.html')
 
+def image_urls(item):
+    """Agregar a un registro las URLs versionadas de su imagen y miniatura"""
+    version = item['version']
+    item['imagen_url'] = url_for('imagen_api', codigo=item['codigo'], v=version)
+    item['miniatura_url'] = url_for('miniatura_api', codigo=item['codigo'], v=version)
+    return item
+
+def image_response(codigo, load_bytes, etag_suffix):
+    """Responder bytes de imagen con ETag/Last-Modified, o 304 si no cambió
+    
+    La validación usa solo los metadatos; la imagen se lee únicamente cuando
+    hay que enviarla. Las URLs con ?v= de la versión actual no cambian nunca
+    (una imagen nueva trae otra versión), así que se pueden cachear sin
+    revalidar.
+    """
+    info = image_db.get_image(codigo, include_data=False)
+    if not info.get('encontrada'):
+        return jsonify({'codigo': codigo, 'encontrada': False}), 404
+    
+    etag = f"{info['version']}-{etag_suffix}"
+    last_modified = datetime.fromisoformat(str(info['timestamp'])).astimezone(timezone.utc).replace(microsecond=0)
+    
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and last_modified <= request.if_modified_since
+    
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        data = load_bytes(codigo)
+        if data is None:
+            return jsonify({'codigo': codigo, 'encontrada': False}), 404
+        response = app.response_class(data, mimetype=image_db.image_mime_type(data))
+    
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if request.args.get('v') == info['version']:
+        response.cache_control.private = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def on_database_event(event, data):
+    """Reenviar cada escritura de la base de datos a los suscriptores SSE"""
+    if event == 'imagen_guardada' and has_request_context():
+        data = image_urls(dict(data))
+    event_broker.publish(event, data)
+    event_broker.publish('estadisticas', image_db.get_statistics())
+
+@app.route('/api/eventos')
+def eventos_api():
+    """Flujo Server-Sent Events: escaneos, imágenes guardadas/eliminadas y estadísticas
+    
+    En modo multiproceso no hay flujo (cada proceso solo vería sus propios
+    eventos y cada conexión ocuparía un hilo sin fin): responde 503 y las
+    páginas vuelven a la consulta periódica.
+    """
+    if MULTIPROCESS:
+        return jsonify({'error': 'Eventos no disponibles en modo multiproceso'}), 503
+    
+    subscription = event_broker.subscribe()
+    if subscription is None:
+        response = jsonify({'error': 'Demasiados clientes conectados a eventos'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    response = app.response_class(event_broker.stream(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/imagen/<path:codigo>')
+def imagen_api(codigo):
+    """Imagen original de un código (bytes tal como se subieron, con caché HTTP)"""
+    return image_response(codigo, image_db.get_image_bytes, 'img')
+
+@app.route('/api/miniatura/<path:codigo>')
+def miniatura_api(codigo):
+    """Miniatura de un código (bytes WebP/JPEG con caché HTTP)"""
+    return image_response(codigo, image_db.get_thumbnail, 'mini')
+
 @app.route('/api/buscar/<codigo>')
 def buscar_imagen_api(codigo):
-    """API para buscar imagen por código"""
+    """API para buscar imagen por código (metadatos y URL de la imagen)"""
     try:
-        resultado = image_db.get_image(codigo)
+        resultado = image_db.get_image(codigo, include_data=False)
+        if resultado.get('encontrada'):
+            image_urls(resultado)
         return jsonify(resultado)
         
     except Exception as e:
@@ -313,13 +714,41 @@ def estadisticas_api():
 
 @app.route('/api/recientes')
 def recientes_api():
-    """API para obtener códigos recientes con opción de incluir imágenes"""
+    """API para obtener códigos recientes con opción de incluir imágenes
+    
+    Con include_images=true cada registro trae las URLs de su imagen y su
+    miniatura, no los bytes. Paginación por clave: before=<timestamp>|<codigo>
+    del último registro recibido. La cabecera X-Sync-Cursor trae el cursor
+    para pedir después solo los cambios con since=<cursor>.
+    """
     try:
         limit = request.args.get('limit', 200, type=int)
         include_images = request.args.get('include_images', 'false').lower() == 'true'
         
-        recientes = image_db.get_recent_codes(limit, include_images)
-        return jsonify(recientes)
+        since = request.args.get('since', type=int)
+        if since is not None:
+            cambios = image_db.get_changes(since, limit)
+            if include_images:
+                cambios['cambios'] = [image_urls(item) for item in cambios['cambios']]
+            return jsonify(cambios)
+        
+        before = None
+        if request.args.get('before'):
+            timestamp, separator, codigo = request.args['before'].partition('|')
+            if not separator:
+                return jsonify({'error': 'before debe tener la forma <timestamp>|<codigo>'}), 400
+            before = (timestamp, codigo)
+        
+        # El cursor se toma antes de la consulta: un cambio concurrente puede
+        # llegar dos veces (inofensivo), pero nunca perderse
+        sync_cursor = image_db.get_sync_cursor()
+        recientes = image_db.get_recent_codes(limit, before=before)
+        if include_images:
+            recientes = [image_urls(item) for item in recientes]
+        
+        response = jsonify(recientes)
+        response.headers['X-Sync-Cursor'] = str(sync_cursor)
+        return response
         
     except Exception as e:
         print(f"Error obteniendo códigos recientes: {str(e)}")
@@ -327,9 +756,12 @@ def recientes_api():
 
 @app.route('/api/buscar-coincidencias/<search_term>')
 def buscar_coincidencias_api(search_term):
-    """API para buscar códigos que contengan el término"""
+    """API para buscar códigos que contengan el término (paginada con limit/offset)"""
     try:
-        resultados = image_db.search_codes(search_term)
+        limit = request.args.get('limit', 50, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        
+        resultados = image_db.search_codes(search_term, limit, offset)
         return jsonify(resultados)
         
     except Exception as e:
@@ -340,14 +772,30 @@ def buscar_coincidencias_api(search_term):
 def config():
     """Endpoint para configuración del servidor"""
     if request.method == 'GET':
-        return jsonify(CONFIG)
+        return jsonify({**CONFIG, 'scanner': scanner.get_config()})
     
     elif request.method == 'POST':
         data = request.get_json()
+        
+        # Configuración del scanner: solo simbologías y perfiles por dispositivo
+        scanner_config = data.get('scanner')
+        if scanner_config:
+            if not isinstance(scanner_config, dict):
+                return jsonify({'success': False, 'error': 'scanner debe ser un objeto'}), 400
+            unknown = [key for key in scanner_config if key not in SCANNER_CONFIG_KEYS]
+            if unknown:
+                return jsonify({'success': False, 'error': f"Opciones de scanner no configurables: {', '.join(map(str, unknown))}"}), 400
+            try:
+                scanner.update_config(scanner_config)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+        
         for key, value in data.items():
             if key in CONFIG:
                 CONFIG[key] = value
-        return jsonify({'success': True, 'config': CONFIG})
+        
+        save_shared_config()
+        return jsonify({'success': True, 'config': CONFIG, 'scanner': scanner.get_config()})
 
 @app.route('/status')
 def status():
@@ -360,7 +808,10 @@ def status():
         'server_type': 'HTTPS only',
         'config': CONFIG,
         'keyboard_status': keyboard.get_status(),
-        'database_stats': db_stats
+        'database_stats': db_stats,
+        'scan_cache': scanner.get_cache_stats(),
+        'scan_queue': scan_scheduler.get_stats(),
+        'events': event_broker.get_stats()
     })
 
 @app.route('/prepare-focus', methods=['POST'])
@@ -440,8 +891,86 @@ def install_certificate_instructions(cert_path, local_ip, https_port):
 """)
     print("="*60)
 
-def run_https_server():
-    """Ejecutar servidor HTTPS solamente"""
+def run_production_server(cert_path, key_path, workers=None, threads=16):
+    """Servir con gunicorn: varios procesos pre-fork con TLS
+    
+    Cada proceso importa server_https por su cuenta (escáner, base de datos
+    y cola propios) y reparte el escaneo entre todos los núcleos. La
+    configuración de /config se comparte por archivo y las estadísticas por
+    método se suman en scanner_stats.json. El seguimiento por sesión y la
+    caché de resultados son de cada proceso (un cuadro que llega a otro
+    solo pierde el atajo); los escaneos asíncronos, /api/eventos y el
+    perfil de captura adaptativo se apagan (ver MULTIPROCESS).
+    
+    Con SIGHUP al proceso maestro (kill -HUP $(cat scanner_server.pid)) los
+    procesos se reemplazan sin cortar peticiones. Cada proceso nuevo vuelve
+    a importar server_https y APP_MODULES desde disco, así que carga el
+    código actualizado; los cambios en run_production_server o en las
+    opciones de gunicorn requieren reiniciar el maestro.
+    
+    Devuelve False si gunicorn no está disponible (p. ej. en Windows).
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("⚠️ gunicorn no está disponible (pip install gunicorn, solo Linux/macOS)")
+        return False
+    
+    class ScannerApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+        
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+        
+        def load(self):
+            # Importación nueva en cada proceso (después del fork). El maestro
+            # ya importó los módulos de la aplicación al arrancar: se descartan
+            # para no heredar su versión en memoria
+            import importlib
+            for name in APP_MODULES:
+                sys.modules.pop(name, None)
+            return importlib.import_module('server_https').app
+    
+    # Configuración inicial compartida; los procesos la heredan por entorno
+    global SHARED_CONFIG_PATH
+    SHARED_CONFIG_PATH = os.path.abspath('server_config.json')
+    os.environ['SCANNER_SHARED_CONFIG'] = SHARED_CONFIG_PATH
+    os.environ['SCANNER_MULTIPROCESS'] = '1'
+    fix_capture_profile()
+    save_shared_config()
+    
+    # El maestro no atiende peticiones: no debe heredar conexiones abiertas
+    image_db.close()
+    
+    options = {
+        'bind': f"{CONFIG['host']}:{CONFIG['https_port']}",
+        'workers': workers or os.cpu_count() or 1,
+        'worker_class': 'gthread',   # Hilos por proceso: clientes lentos no bloquean
+        'threads': threads,
+        'certfile': cert_path,
+        'keyfile': key_path,
+        'keepalive': 5,
+        'timeout': 60,
+        'graceful_timeout': 30,
+        'pidfile': 'scanner_server.pid',
+        'accesslog': None,
+        'errorlog': '-'
+    }
+    
+    print(f"🏭 Modo producción: {options['workers']} procesos x {threads} hilos (gunicorn)")
+    print("🔄 Recarga sin cortes (código de la aplicación y plantillas): kill -HUP $(cat scanner_server.pid)")
+    ScannerApplication(options).run()
+    return True
+
+def run_https_server(production=False, workers=None, threads=16):
+    """Ejecutar servidor HTTPS solamente
+    
+    Con production=True usa run_production_server; si gunicorn no está
+    instalado, sigue con el servidor de desarrollo de Flask.
+    """
     local_ip = get_local_ip()
     
     # Crear certificados SSL
@@ -476,6 +1005,9 @@ def run_https_server():
         print(f"🔍 Búsqueda de imágenes: https://{local_ip}:{CONFIG['https_port']}/buscar")
         print("\n⏹️  Presiona Ctrl+C para detener")
         
+        if production and run_production_server(cert_path, key_path, workers, threads):
+            return
+        
         app.run(
             host=CONFIG['host'],
             port=CONFIG['https_port'],
@@ -488,9 +1020,39 @@ def run_https_server():
         safe_print(f"\n❌ Error iniciando servidor HTTPS: {e}")
         print("💡 Verifica que el puerto 5443 esté libre")
 
+def init_components():
+    """Crear escáner, teclado, base de datos, eventos y cola de escaneos"""
+    global scanner, keyboard, image_db, event_broker, scan_scheduler
+    
+    scanner = BarcodeScanner()
+    keyboard = KeyboardSimulator()
+    image_db = ImageDatabase()
+    event_broker = EventBroker()
+    scan_scheduler = ScanScheduler(workers=SCAN_WORKERS, max_queue=SCAN_QUEUE_SIZE,
+                                   on_complete=on_scan_job_done)
+    
+    image_db.add_listener(on_database_event)
+    if MULTIPROCESS:
+        fix_capture_profile()
+
+# Los procesos del pool de decodificación paralela (spawn) vuelven a ejecutar
+# el módulo principal como __mp_main__; solo usan funciones de scanner.py y no
+# deben abrir la base de datos, el teclado ni arrancar hilos de escaneo
+if __name__ != '__mp_main__':
+    init_components()
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scanner Server HTTPS')
+    parser.add_argument('--production', action='store_true',
+                        help='Servidor multiproceso pre-fork con gunicorn (Linux/macOS)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Procesos en modo producción (por defecto, uno por núcleo)')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Hilos por proceso en modo producción')
+    args = parser.parse_args()
+    
     try:
-        run_https_server()
+        run_https_server(production=args.production, workers=args.workers, threads=args.threads)
     except KeyboardInterrupt:
         print("\n👋 Cerrando servidor HTTPS...")
     except Exception as e: